@@ -15,5 +15,5 @@
 # along with pyema.  If not, see <http://www.gnu.org/licenses/>.
 ##
 
-__all__ = ["ema"]
+__all__ = ["ema", "weights", "metrics", "dataset", "arrayfile", "sweep", "checkpoint", "server", "snapshot", "deferred", "shared"]
 
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""
+Binary container of named numpy arrays
+
+A container file is laid out as:
+
+    MAGIC                  8 bytes
+    header length          little-endian uint32
+    header                 JSON with the kind of content, its metadata and
+                           the dtype, shape and offset of every array
+    arrays                 Raw little-endian data, each one aligned to ALIGN
+                           bytes from the beginning of the file
+
+so every array can be opened with numpy.memmap without copying it.
+"""
+
+import json
+import logging
+import shutil
+import struct
+import tempfile
+
+import numpy
+
+
+__author__ = "José Antonio Martín Baena"
+__email__ = "jose.antonio.martin.baena@gmail.com"
+
+LOG = logging.getLogger("ema.arrayfile")
+
+"""First bytes of every container"""
+MAGIC = "\x93PYEMA\x01\n"
+
+"""Alignment of the arrays within a container"""
+ALIGN = 64
+
+
+def _little(dtype):
+    """It returns the little-endian version of the given dtype"""
+    return numpy.dtype(dtype).newbyteorder("<")
+
+
+def _header(kind, meta, arrays):
+    """
+    It lays out the header and the arrays of a container
+
+    @param arrays: Sequence of (name, dtype, shape) tuples
+    @returns: The bytes before the first array, and the offset of each array
+    @rtype  : (str, [int])
+    """
+    entries = [{"name": name, "dtype": _little(dtype).str,
+                "shape": list(shape)} for (name, dtype, shape) in arrays]
+    # Offsets depend on the length of the header, which depends on them
+    offsets = [0] * len(entries)
+    while True:
+        for (entry, offset) in zip(entries, offsets):
+            entry["offset"] = offset
+        header = json.dumps({"kind": kind, "meta": meta or {},
+                             "arrays": entries}, sort_keys=True)
+        start = len(MAGIC) + 4 + len(header)
+        fixed = []
+        for entry in entries:
+            start += -start % ALIGN
+            fixed.append(start)
+            start += (numpy.dtype(entry["dtype"]).itemsize *
+                      int(numpy.prod(entry["shape"])))
+        if fixed == offsets:
+            return (MAGIC + struct.pack("<I", len(header)) + header, offsets)
+        offsets = fixed
+
+
+def save(f, kind, arrays, meta=None):
+    """
+    It writes several arrays into a container
+
+    @param f: The file (or its name) to write the container to
+    @param kind: Kind of content of the container
+    @type  kind: str
+    @param arrays: The (name, array) to be written
+    @param meta: JSON-serialisable metadata of the content
+    @type  meta: dict
+    """
+    arrays = [(name, numpy.ascontiguousarray(a, dtype=_little(a.dtype)))
+              for (name, a) in arrays]
+    (head, offsets) = _header(kind, meta,
+                              [(name, a.dtype, a.shape) for (name, a) in arrays])
+    if isinstance(f, basestring):
+        with open(f, "wb") as out:
+            return _write(out, head, offsets, [a for (_, a) in arrays])
+    _write(f, head, offsets, [a for (_, a) in arrays])
+
+
+def _write(out, head, offsets, sources):
+    """It writes the header and the arrays (or files) at their offsets"""
+    out.write(head)
+    position = len(head)
+    for (source, offset) in zip(sources, offsets):
+        out.write("\0" * (offset - position))
+        if isinstance(source, numpy.ndarray):
+            out.write(source.data)
+            position = offset + source.nbytes
+        else:
+            source.seek(0)
+            shutil.copyfileobj(source, out)
+            position = source.tell() + offset
+
+
+def peek(f):
+    """
+    It tells whether a file is a container, leaving it where it was
+
+    @param f: The file to check, which must be seekable
+    @rtype  : bool
+    """
+    position = f.tell()
+    try:
+        return f.read(len(MAGIC)) == MAGIC
+    finally:
+        f.seek(position)
+
+
+def load(f, mmap=True, mode="r"):
+    """
+    It reads a container
+
+    @param f: The name of the container (or an open file, if not mmap)
+    @param mmap: Whether to map the arrays in memory instead of reading them
+    @param mode: Mode of numpy.memmap ('r', 'r+' or 'c' for copy-on-write)
+    @returns: The kind of content, its metadata and its arrays by name
+    @rtype  : (str, dict, {str: numpy.ndarray})
+    @raises ValueError: If f is not a container
+    """
+    if isinstance(f, basestring):
+        with open(f, "rb") as inp:
+            (kind, meta, entries) = _read_header(inp)
+            if not mmap:
+                return (kind, meta, _read_arrays(inp, entries))
+    else:
+        (kind, meta, entries) = _read_header(f)
+        if not mmap:
+            return (kind, meta, _read_arrays(f, entries))
+        f = f.name
+    arrays = {}
+    for entry in entries:
+        dtype = numpy.dtype(str(entry["dtype"]))
+        shape = tuple(entry["shape"])
+        if not numpy.prod(shape):
+            # Empty regions cannot be mapped
+            arrays[entry["name"]] = numpy.zeros(shape, dtype=dtype)
+        else:
+            arrays[entry["name"]] = numpy.memmap(f, dtype=dtype, mode=mode,
+                    offset=entry["offset"], shape=shape)
+    return (kind, meta, arrays)
+
+
+def _read_header(inp):
+    """It reads the header of a container"""
+    if inp.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a pyema container: {!r}".format(
+                getattr(inp, "name", inp)))
+    (length,) = struct.unpack("<I", inp.read(4))
+    header = json.loads(inp.read(length))
+    return (header["kind"], header["meta"], header["arrays"])
+
+
+def _read_arrays(inp, entries):
+    """It reads the arrays of a container into memory"""
+    arrays = {}
+    position = inp.tell()
+    for entry in entries:
+        dtype = numpy.dtype(str(entry["dtype"]))
+        count = int(numpy.prod(entry["shape"]))
+        inp.read(entry["offset"] - position)
+        a = numpy.fromstring(inp.read(count * dtype.itemsize), dtype=dtype)
+        arrays[entry["name"]] = a.reshape(entry["shape"])
+        position = entry["offset"] + a.nbytes
+    return arrays
+
+
+
+class Writer(object):
+    """
+    Container whose arrays are written a chunk a time
+
+    Every array is spooled to a temporary file until the container is
+    closed, when their final sizes are known and the container is written.
+
+    For instance:
+
+    >>> w = Writer("out.bin", "dataset", [("a", "<i4"), ("b", "<f8")])
+    >>> w.append("a", numpy.arange(3))
+    >>> w.append("a", numpy.arange(2))
+    >>> w.close({"size": 5})
+    """
+
+    def __init__(self, f, kind, arrays):
+        """
+        @param f: The file (or its name) to write the container to
+        @param kind: Kind of content of the container
+        @param arrays: The (name, dtype) of the arrays, which are 1-D
+        """
+        self._f = f
+        self._kind = kind
+        self._names = [name for (name, _) in arrays]
+        self._dtypes = dict((name, _little(dtype))
+                            for (name, dtype) in arrays)
+        self._sizes = dict((name, 0) for name in self._names)
+        self._spool = dict((name, tempfile.TemporaryFile())
+                           for name in self._names)
+
+
+    def append(self, name, a):
+        """It appends the values in a to the named array"""
+        a = numpy.ascontiguousarray(a, dtype=self._dtypes[name])
+        self._spool[name].write(a.data)
+        self._sizes[name] += a.size
+
+
+    def close(self, meta=None):
+        """It writes the container with the given metadata"""
+        (head, offsets) = _header(self._kind, meta,
+                [(name, self._dtypes[name], (self._sizes[name],))
+                 for name in self._names])
+        sources = [self._spool[name] for name in self._names]
+        try:
+            if isinstance(self._f, basestring):
+                with open(self._f, "wb") as out:
+                    _write(out, head, offsets, sources)
+            else:
+                _write(self._f, head, offsets, sources)
+        finally:
+            for source in sources:
+                source.close()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""
+Checkpoints of long runs of EMA over a dataset
+
+A checkpoint is a saved model (see Ema.save) whose metadata also holds the
+position in the dataset and the running sums of the metrics, so a run can
+go on from it instead of starting again from the first event.
+
+Checkpoints are written by a background thread from a copy of the model,
+first into a temporary file which is then renamed, so a run which dies
+while writing one still leaves the previous checkpoint untouched.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from pyema import arrayfile
+from pyema.ema import Ema, MODEL_KIND
+
+
+__author__ = "José Antonio Martín Baena"
+__email__ = "jose.antonio.martin.baena@gmail.com"
+
+LOG = logging.getLogger("ema.checkpoint")
+
+"""Suffix of the name of the checkpoint of a dataset"""
+CHECKPOINT_SUFFIX = ".ckpt"
+
+
+"""
+State of a run restored from a checkpoint
+
+     ema - The model
+   start - The first event of the dataset processed by the run
+  events - The number of events processed since start
+ metrics - The state of every metric (see Metric.get_state)
+"""
+Checkpoint = namedtuple("Checkpoint", ["ema", "start", "events", "metrics"])
+
+
+def checkpoint_name(name):
+    """It returns the name of the checkpoint of the given dataset"""
+    return name + CHECKPOINT_SUFFIX
+
+
+class Checkpointer(object):
+    """
+    Writer of the checkpoints of a run, every some events or seconds
+
+    For instance:
+
+    >>> checkpointer = Checkpointer("run.ckpt", every=10000)
+    >>> for (i, (clss, fs)) in enumerate(dataset):
+    ...     ema.predict_and_learn_indices(fs, clss)
+    ...     if checkpointer.due(i + 1):
+    ...         checkpointer.save(ema, i + 1, metrics)
+    >>> checkpointer.close()
+    """
+
+    def __init__(self, path, every=None, seconds=None, start=0):
+        """
+        @param path: The name of the checkpoint file
+        @param every: The number of events between checkpoints
+        @param seconds: The number of seconds between checkpoints
+        @param start: The first event of the dataset processed by the run
+        """
+        self.path = path
+        self.every = every
+        self.seconds = seconds
+        self.start = start
+        self._last = time.time()
+        self._thread = None
+        self._error = None
+
+
+    def due(self, events):
+        """It tells whether a checkpoint is due after the given events"""
+        if self.every and events % self.every == 0:
+            return True
+        return bool(self.seconds) and \
+                time.time() - self._last >= self.seconds
+
+
+    def save(self, ema, events, metrics=()):
+        """
+        It writes a checkpoint in the background
+
+        The state of the model is taken right away, and it is a copy (see
+        Ema.get_state), so the model can go on learning while the copy is
+        written. It waits for the previous checkpoint, if it is still being
+        written.
+
+        @param ema: The model
+        @param events: The number of events processed since start
+        @param metrics: The metrics of the run
+        """
+        (meta, arrays) = ema.get_state()
+        meta["checkpoint"] = {"start": self.start, "events": events,
+                              "metrics": [m.get_state() for m in metrics]}
+        self.wait()
+        self._last = time.time()
+        self._thread = threading.Thread(target=self._write,
+                                        args=(meta, arrays))
+        self._thread.start()
+
+
+    def _write(self, meta, arrays):
+        """It writes a checkpoint into a temporary file and renames it"""
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "wb") as out:
+                arrayfile.save(out, MODEL_KIND, arrays, meta)
+                out.flush()
+                os.fsync(out.fileno())
+            os.rename(tmp, self.path)
+            LOG.debug("Checkpoint after {:d} events".format(
+                    meta["checkpoint"]["events"]))
+        except (IOError, OSError) as e:
+            LOG.error("Error writting checkpoint {:s}: {!s}".format(
+                    self.path, e))
+            self._error = e
+
+
+    def wait(self):
+        """
+        It waits until the last checkpoint is written
+
+        @raises IOError, OSError: If it could not be written
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            (e, self._error) = (self._error, None)
+            raise e
+
+
+    close = wait
+
+
+
+def load_checkpoint(path, mmap=True):
+    """
+    It reads a checkpoint
+
+    @param path: The name of the checkpoint file
+    @param mmap: Whether to map W in memory (copy-on-write)
+    @returns: The state of the run (None if there is no checkpoint)
+    @rtype  : Checkpoint
+    @raises ValueError: If path is not a checkpoint
+    """
+    if not os.path.exists(path):
+        return None
+    (kind, meta, arrays) = arrayfile.load(path, mmap, mode="c")
+    if kind != MODEL_KIND or "checkpoint" not in meta:
+        raise ValueError("Not a checkpoint: {!r}".format(path))
+    state = meta["checkpoint"]
+    return Checkpoint(Ema.from_state(meta, arrays), state["start"],
+                      state["events"], state["metrics"])
+
@@ -0,0 +1,487 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""
+Bulk reader of encoded (.sparse) datasets
+
+Every line of an encoded file is of the form:
+    <class> <num_features> <index_feature_1> ... <index_feature_n>
+
+Instead of parsing it line by line, big blocks of the file are parsed at once
+into flat arrays, CSR-style:
+
+    classes - The class of every event
+     indptr - Offsets of the features of every event in indices
+    indices - The indexes of the active features of all the events
+
+So the features of the i-th event are indices[indptr[i]:indptr[i + 1]].
+Indexes are kept as they are in the file, i.e., starting at 1.
+
+Datasets can be converted into binary containers (see pyema.arrayfile) of
+these arrays, which are later mapped in memory instead of parsed again:
+
+>  ema-convert scientist-17.sparse -o scientist-17.ema
+>  greenberg.py scientist-17 | ema-convert -o scientist-17.ema
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import namedtuple
+
+import numpy
+
+from pyema import arrayfile
+
+
+__author__ = "José Antonio Martín Baena"
+__email__ = "jose.antonio.martin.baena@gmail.com"
+
+LOG = logging.getLogger("ema.dataset")
+
+"""Number of bytes read from a file at once"""
+CHUNK_SIZE = 1 << 22
+
+"""Integer type of the classes and the indexes of the features"""
+ITYPE = numpy.int32
+
+"""Kind of the binary containers of datasets"""
+KIND = "dataset"
+
+"""Number of events per block when iterating over a binary dataset"""
+BLOCK_EVENTS = 1 << 16
+
+"""Number of events between byte offsets in the index of a dataset"""
+INDEX_EVERY = 1024
+
+"""Suffix of the name of the sidecar index of a dataset"""
+INDEX_SUFFIX = ".idx"
+
+_WHITESPACE = numpy.zeros(256, dtype=bool)
+_WHITESPACE[[ord(c) for c in " \t\r\n\v\f"]] = True
+
+_DIGIT = numpy.zeros(256, dtype=bool)
+_DIGIT[[ord(c) for c in "0123456789"]] = True
+
+_INTEGER = _WHITESPACE | _DIGIT
+_INTEGER[[ord(c) for c in "+-"]] = True
+
+
+"""
+Block of events
+
+Offsets in indptr point into indices but, in slices of bigger blocks, they do
+not need to start at 0.
+"""
+Dataset = namedtuple("Dataset", ["classes", "indptr", "indices"])
+
+
+def parse_block(text):
+    """
+    It parses a block of whole lines of an encoded file
+
+    @param text: Lines of an encoded file
+    @type  text: str
+    @returns: The events in the lines
+    @rtype  : (classes, indptr, indices)
+    @raises ValueError: If the lines are not properly encoded
+    """
+    return _parse_block(text)[0]
+
+
+def _parse_block(text):
+    """It parses a block, also returning the byte offset of every event"""
+    chars = numpy.frombuffer(text, dtype=numpy.uint8)
+    ws = _WHITESPACE[chars]
+    # First character of every token
+    starts = numpy.flatnonzero(~ws & numpy.concatenate(([True], ws[:-1])))
+    if not len(starts):
+        return (_empty(), numpy.zeros(0, dtype=int))
+    wrong = numpy.flatnonzero(~_INTEGER[chars])
+    if len(wrong):
+        raise ValueError("Not an integer at byte {:d}".format(wrong[0]))
+    # Signs may only start a token, right before its digits
+    signs = numpy.flatnonzero(~_DIGIT[chars] & ~ws)
+    first = numpy.concatenate(([True], ws[:-1]))[signs]
+    digit = numpy.concatenate((_DIGIT[chars[1:]], [False]))[signs]
+    wrong = signs[~(first & digit)]
+    if len(wrong):
+        raise ValueError("Not an integer at byte {:d}".format(wrong[0]))
+    tokens = numpy.fromstring(text, dtype=numpy.int64, sep=" ")
+    if len(tokens) != len(starts):
+        raise ValueError("Wrong number of integers: {:d}".format(
+                len(tokens)))
+    limits = numpy.iinfo(ITYPE)
+    wrong = numpy.flatnonzero((tokens < limits.min) | (tokens > limits.max))
+    if len(wrong):
+        raise ValueError("Integer out of range at byte {:d}".format(
+                starts[wrong[0]]))
+
+    # Number of tokens of every (non-empty) line
+    newlines = numpy.flatnonzero(chars == ord("\n"))
+    lines = numpy.searchsorted(newlines, starts)
+    counts = numpy.bincount(lines)
+    counts = counts[counts > 0]
+    heads = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    if (counts < 2).any():
+        raise ValueError("Line without number of features")
+
+    classes = tokens[heads].astype(ITYPE)
+    nfeatures = tokens[heads + 1]
+    if (nfeatures != counts - 2).any():
+        line = numpy.flatnonzero(nfeatures != counts - 2)[0]
+        raise ValueError("Wrong number of features in line {:d}: {:d}"
+                         .format(line + 1, int(nfeatures[line])))
+    keep = numpy.ones(len(tokens), dtype=bool)
+    keep[heads] = False
+    keep[heads + 1] = False
+    indices = tokens[keep].astype(ITYPE)
+    indptr = numpy.zeros(len(classes) + 1, dtype=ITYPE)
+    numpy.cumsum(nfeatures, out=indptr[1:])
+    return (Dataset(classes, indptr, indices), starts[heads])
+
+
+def _empty():
+    """It returns a block without events"""
+    return Dataset(numpy.zeros(0, ITYPE), numpy.zeros(1, ITYPE),
+                   numpy.zeros(0, ITYPE))
+
+
+def read_blocks(f, chunk_size=CHUNK_SIZE):
+    """
+    It parses an encoded file a block a time
+
+    @param f: The encoded file
+    @param chunk_size: Approximate number of bytes of every block
+    @returns: A generator of (classes, indptr, indices) blocks
+    """
+    for (_, text) in _chunks(f, chunk_size):
+        yield parse_block(text)
+
+
+def _chunks(f, chunk_size):
+    """It splits a file into chunks of whole lines and their byte offsets"""
+    try:
+        offset = f.tell()
+    except (IOError, AttributeError):
+        offset = 0
+    rest = ""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        end = chunk.rfind("\n") + 1
+        if not end:
+            rest += chunk
+            continue
+        text = rest + chunk[:end]
+        rest = chunk[end:]
+        yield (offset, text)
+        offset += len(text)
+    if rest.strip():
+        yield (offset, rest)
+
+
+def concatenate(blocks):
+    """
+    It joins several blocks of events into a single one
+
+    @param blocks: The (classes, indptr, indices) blocks
+    @rtype  : Dataset
+    """
+    classes = []
+    indptr = [numpy.zeros(1, ITYPE)]
+    indices = []
+    offset = 0
+    for (c, p, i) in blocks:
+        classes.append(c)
+        indptr.append(p[1:] - p[0] + offset)
+        indices.append(i[p[0]:p[-1]])
+        offset += p[-1] - p[0]
+    if not classes:
+        return _empty()
+    return Dataset(numpy.concatenate(classes), numpy.concatenate(indptr),
+                   numpy.concatenate(indices))
+
+
+def load(f, chunk_size=CHUNK_SIZE):
+    """
+    It parses a whole encoded file
+
+    @param f: The encoded file
+    @rtype  : Dataset
+    """
+    return concatenate(read_blocks(f, chunk_size))
+
+
+def take(blocks, start=0, count=None):
+    """
+    It drops the first start events of several blocks and keeps count of them
+
+    @param blocks: The (classes, indptr, indices) blocks
+    @param start: The number of events to drop
+    @param count: The maximum number of events to keep (None for all)
+    @returns: A generator of Dataset blocks
+    """
+    for (classes, indptr, indices) in blocks:
+        if count is not None and count <= 0:
+            break
+        n = len(classes)
+        if start >= n:
+            start -= n
+            continue
+        end = n if count is None else min(n, start + count)
+        yield Dataset(classes[start:end], indptr[start:end + 1], indices)
+        if count is not None:
+            count -= end - start
+        start = 0
+
+
+def split(dataset, size=BLOCK_EVENTS):
+    """
+    It splits a dataset into blocks of (views of) size events
+
+    @param dataset: The dataset to split
+    @type  dataset: Dataset
+    @returns: A generator of Dataset blocks
+    """
+    (classes, indptr, indices) = dataset
+    for start in xrange(0, len(classes), size):
+        end = min(start + size, len(classes))
+        yield Dataset(classes[start:end], indptr[start:end + 1], indices)
+
+
+def save_binary(f, blocks):
+    """
+    It writes several blocks of events into a binary container
+
+    The metadata of the container holds the number of events (events) and
+    the greatest index of a feature (features) and of a class (classes).
+
+    @param f: The file (or its name) to write the container to
+    @param blocks: The (classes, indptr, indices) blocks
+    @returns: The metadata of the container
+    @rtype  : dict
+    """
+    writer = arrayfile.Writer(f, KIND, [("classes", ITYPE),
+                                        ("indptr", ITYPE),
+                                        ("indices", ITYPE)])
+    writer.append("indptr", numpy.zeros(1, ITYPE))
+    meta = {"events": 0, "features": 0, "classes": 0}
+    offset = 0
+    for (c, p, i) in blocks:
+        i = i[p[0]:p[-1]]
+        writer.append("classes", c)
+        writer.append("indptr", p[1:] - p[0] + offset)
+        writer.append("indices", i)
+        offset += p[-1] - p[0]
+        meta["events"] += len(c)
+        if len(c):
+            meta["classes"] = max(meta["classes"], int(c.max()))
+        if len(i):
+            meta["features"] = max(meta["features"], int(i.max()))
+    writer.close(meta)
+    return meta
+
+
+def load_binary(f, mmap=True):
+    """
+    It opens a binary container of events
+
+    @param f: The name of the container (or an open file, if not mmap)
+    @param mmap: Whether to map the arrays in memory instead of reading them
+    @returns: The events and the metadata of the container
+    @rtype  : (Dataset, dict)
+    @raises ValueError: If f is not a container of events
+    """
+    (kind, meta, arrays) = arrayfile.load(f, mmap)
+    if kind != KIND:
+        raise ValueError("Not a dataset but a {!r}".format(kind))
+    return (Dataset(arrays["classes"], arrays["indptr"], arrays["indices"]),
+            meta)
+
+
+def read_dataset(f, start=0, count=None, index=None):
+    """
+    It reads blocks of events from either an encoded or a binary file
+
+    @param f: The file to read
+    @param start: The number of events to skip
+    @param count: The maximum number of events to read (None for all)
+    @param index: Index of f (see build_index) to seek to start instead of
+                  parsing the events before it
+    @returns: A generator of Dataset blocks
+    """
+    if _is_binary(f):
+        (classes, indptr, indices) = load_binary(f.name)[0]
+        end = len(classes) if count is None else start + count
+        return split(Dataset(classes[start:end], indptr[start:end + 1],
+                             indices))
+    if index and start:
+        f.seek(index["offsets"][start // index["every"]])
+        start %= index["every"]
+    return take(read_blocks(f), start, count)
+
+
+def _is_binary(f):
+    """It tells whether f is a binary container"""
+    try:
+        return arrayfile.peek(f)
+    except (IOError, AttributeError):
+        # Not seekable (e.g., a pipe), so it must be encoded
+        return False
+
+
+def build_index(f, every=INDEX_EVERY):
+    """
+    It scans a dataset to build its index
+
+    The index holds the number of events (events), the greatest index of a
+    feature (features) and of a class (classes) and, for encoded files, the
+    byte offset of every other every events (offsets) and the size of the
+    file (size) to tell whether the index is stale.
+
+    @param f: The file to index, which must be at its beginning
+    @param every: The number of events between offsets
+    @rtype  : dict
+    """
+    if _is_binary(f):
+        index = dict(load_binary(f.name)[1])
+        index.update(every=0, offsets=[])
+        return index
+    index = {"events": 0, "features": 0, "classes": 0, "every": every,
+             "offsets": []}
+    offsets = []
+    for (offset, text) in _chunks(f, CHUNK_SIZE):
+        ((classes, indptr, indices), starts) = _parse_block(text)
+        first = -index["events"] % every
+        offsets.append(starts[first::every] + offset)
+        index["events"] += len(classes)
+        if len(classes):
+            index["classes"] = max(index["classes"], int(classes.max()))
+        if len(indices):
+            index["features"] = max(index["features"], int(indices.max()))
+    index["offsets"] = [int(o) for a in offsets for o in a]
+    index["size"] = f.tell()
+    return index
+
+
+def index_name(name):
+    """It returns the name of the sidecar index of the given dataset"""
+    return name + INDEX_SUFFIX
+
+
+def load_index(name, create=False, every=INDEX_EVERY):
+    """
+    It reads the sidecar index of a dataset
+
+    @param name: The name of the dataset
+    @param create: Whether to build and save the index if it is missing or
+                   stale
+    @param every: The number of events between offsets of a new index
+    @returns: The index (None if it is missing or stale and not created)
+    @rtype  : dict
+    """
+    try:
+        with open(index_name(name), "r") as inp:
+            index = json.load(inp)
+        if index.get("size", os.path.getsize(name)) == \
+                os.path.getsize(name):
+            return index
+        LOG.warning("Stale index of {:s}".format(name))
+    except (IOError, ValueError):
+        pass
+    if not create:
+        return None
+    with open(name, "rb") as inp:
+        index = build_index(inp, every)
+    with open(index_name(name), "w") as out:
+        json.dump(index, out)
+    return index
+
+
+def shards(events, n):
+    """
+    It splits events into n consecutive shards of (almost) the same size
+
+    @param events: The number of events
+    @param n: The number of shards
+    @returns: The (start, count) of every shard
+    @rtype  : [(int, int)]
+    """
+    bounds = [events * i // n for i in range(n + 1)]
+    return [(bounds[i], bounds[i + 1] - bounds[i]) for i in range(n)]
+
+
+def events(blocks):
+    """
+    It iterates over the events of several blocks
+
+    @param blocks: The (classes, indptr, indices) blocks (or one Dataset)
+    @returns: A generator of (<class>, <array of index_feature_i>) tuples
+    """
+    if isinstance(blocks, Dataset):
+        blocks = split(blocks)
+    for (classes, indptr, indices) in blocks:
+        bounds = indptr.tolist()
+        for (i, clss) in enumerate(classes.tolist()):
+            yield (clss, indices[bounds[i]:bounds[i + 1]])
+
+
+
+def main():
+    """\
+It converts an encoded dataset into a binary container
+
+Execute as a script with '-h' for details
+   """
+    parser = argparse.ArgumentParser(description="""\
+            It converts an encoded dataset, e.g. the output of greenberg.py,
+            into a binary container which EMA maps in memory""")
+    parser.add_argument('file',
+            help="Encoded file to convert (standard input by default)",
+            type=argparse.FileType('r'),
+            metavar="F",
+            nargs="?",
+            default=sys.stdin)
+    parser.add_argument('-o',
+            help="File to write the binary container to",
+            required=True)
+    parser.add_argument('-g',
+            help="The input is a Greenberg's file, encode it first",
+            action='store_true')
+
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    if args.g:
+        from greenberg.greenberg import FeaturizeGreenberg
+        encoded = FeaturizeGreenberg().get_encoding(args.file)
+        blocks = (Dataset(numpy.array([clss], ITYPE),
+                          numpy.array([0, len(fs)], ITYPE),
+                          numpy.array(fs, ITYPE))
+                  for (clss, fs) in encoded)
+    else:
+        blocks = read_blocks(args.file)
+    meta = save_binary(args.o, blocks)
+    LOG.info("Converted {:d} events".format(meta["events"]))
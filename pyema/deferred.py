@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""
+Deferred learning of EMA, off the path of predictions
+
+Learning calls only queue their event and return; a background thread
+learns the queued events in order into a SnapshotEma, whose snapshots serve
+the predictions meanwhile (see pyema.snapshot).
+
+A burst of identical events (same features and class) takes a single slot
+of the queue. It is learnt again and again only while EMA keeps updating
+W: once the margin of the event is met, learning it once more would not
+change anything, so the rest of the burst is skipped and the result is
+the same as learning every event.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from Queue import Full
+
+import numpy
+
+from pyema.snapshot import SnapshotEma
+
+
+__author__ = "José Antonio Martín Baena"
+__email__ = "jose.antonio.martin.baena@gmail.com"
+
+LOG = logging.getLogger("ema.deferred")
+
+"""Default maximum number of (coalesced) events waiting to be learnt"""
+MAX_PENDING = 10000
+
+
+class DeferredEma(object):
+    """
+    Model whose learning is queued and done by a background thread
+
+    For instance:
+
+    >>> model = DeferredEma(SnapshotEma(Ema(engine="rows"), every=100))
+    >>> model.learn_indices([0, 4], 2)            # returns at once
+    >>> model.predict_rank_indices([0, 4], 5)     # from the last snapshot
+    >>> model.pending, model.staleness            # what is not learnt yet
+    >>> model.close()
+
+    @ivar coalesced: Number of events which joined the previous one in the
+              queue, as they were identical
+    """
+
+    def __init__(self, model=None, maxsize=MAX_PENDING):
+        """
+        @param model: The model to learn into (default = a new SnapshotEma)
+        @type  model: SnapshotEma
+        @param maxsize: The maximum number of (coalesced) events waiting to
+                  be learnt (None = unbounded)
+        """
+        self.model = model if model is not None else SnapshotEma()
+        self.maxsize = maxsize
+        self.coalesced = 0
+        self._queue = deque()
+        self._current = None
+        self._pending = 0
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def get_pending(self):
+        """It returns the number of events not learnt yet"""
+        return self._pending
+    pending = property(get_pending)
+
+
+    def get_staleness(self):
+        """
+        It returns how long (in seconds) the oldest event not learnt yet has
+        been waiting (0 if there is none)
+        """
+        with self._cond:
+            oldest = self._current or (self._queue[0] if self._queue else None)
+            return time.time() - oldest[4] if oldest else 0.
+    staleness = property(get_staleness)
+
+
+    def learn(self, x, y, block=True, timeout=None):
+        """
+        It queues an event to learn class y for features x (see Ema.learn)
+
+        @param block: Whether to wait for room in the queue if it is full
+        @param timeout: The maximum time (in seconds) to wait for it
+        @raises Queue.Full: If there is no room in the queue
+        """
+        x = x.tocsr()
+        key = (x.indices.tostring(), x.data.tostring(), x.shape, y)
+        self._put(key, self.model.learn, (x, y), block, timeout)
+
+
+    def learn_indices(self, f, y, block=True, timeout=None):
+        """
+        It queues an event to learn class y for features f (see
+        Ema.learn_indices)
+
+        @param block: Whether to wait for room in the queue if it is full
+        @param timeout: The maximum time (in seconds) to wait for it
+        @raises Queue.Full: If there is no room in the queue
+        """
+        f = numpy.array(f, dtype=numpy.intc)
+        self._put((f.tostring(), y), self.model.learn_indices, (f, y),
+                  block, timeout)
+
+
+    def _put(self, key, method, args, block, timeout):
+        """It queues an event, or joins it to the last one if identical"""
+        with self._cond:
+            self._check()
+            queue = self._queue
+            if queue and queue[-1][0] == key:
+                queue[-1][3] += 1
+                self.coalesced += 1
+            else:
+                if self.maxsize and len(queue) >= self.maxsize:
+                    if not block:
+                        raise Full()
+                    end = None if timeout is None else time.time() + timeout
+                    while len(self._queue) >= self.maxsize:
+                        remaining = None if end is None else end - time.time()
+                        if remaining is not None and remaining <= 0:
+                            raise Full()
+                        self._cond.wait(remaining)
+                        self._check()
+                queue.append([key, method, args, 1, time.time()])
+            self._pending += 1
+            self._cond.notify_all()
+
+
+    def _run(self):
+        """It learns the queued events in order until closed"""
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                self._current = entry = self._queue.popleft()
+                self._cond.notify_all()
+            (_, method, args, count, _) = entry
+            try:
+                for i in xrange(count):
+                    if not method(*args):
+                        # The rest of the burst would not change anything
+                        self.model.skip(count - i - 1)
+                        break
+            except Exception as e:
+                LOG.exception("Error learning an event")
+                with self._cond:
+                    self._error = e
+                    self._current = None
+                    self._pending = 0
+                    self._queue.clear()
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._current = None
+                self._pending -= count
+                self._cond.notify_all()
+
+
+    def _check(self):
+        """It raises the error of the background thread, if any"""
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise ValueError("Learning into a closed DeferredEma")
+
+
+    def wait(self):
+        """
+        It waits until every queued event has been learnt
+
+        Predictions only see them once the model publishes a snapshot (see
+        SnapshotEma.publish).
+        """
+        with self._cond:
+            while self._pending and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+
+
+    def close(self):
+        """It learns every queued event and stops the background thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+    def predict(self, x):
+        """It returns the predicted class for features x (see Ema.predict)"""
+        return self.model.predict(x)
+
+
+    def predict_rank(self, x, k=None):
+        """It returns the k most likely classes (see Ema.predict_rank)"""
+        return self.model.predict_rank(x, k)
+
+
+    def predict_rank_indices(self, f, k=None):
+        """
+        It returns the k most likely classes (see Ema.predict_rank_indices)
+        """
+        return self.model.predict_rank_indices(f, k)
+
+
+    def predict_rank_batch(self, X, k):
+        """
+        It returns the k most likely classes of several feature vectors
+
+        See Ema.predict_rank_batch.
+        """
+        return self.model.predict_rank_batch(X, k)
@@ -33,8 +33,13 @@ algorithm is Omid Madani and you can check out the details in:
 """
 
 import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
 import time
 import sys
+from StringIO import StringIO
 
 try:
     # For the main function
@@ -49,9 +54,15 @@ except ImportError:
 import cProfile
 import pstats
 
-from scipy.sparse import coo_matrix, lil_matrix, csr_matrix
+from scipy.sparse import csr_matrix, isspmatrix
 import numpy
 
+from pyema.weights import ENGINES
+from pyema import arrayfile
+from pyema.dataset import Dataset, read_blocks, read_dataset, events, \
+        load_binary, load_index, shards
+from pyema.metrics import RecallAtK, depth, parse_metric
+
 
 __date__ = "2012"
 __author__ = "José Antonio Martín Baena"
@@ -66,6 +77,16 @@ LOG = logging.getLogger("ema")
 """Auxiliary var used for optimisation tests"""
 files = None
 
+"""Binary record of a result of process_dataset: [clss, yp, r1, r5]"""
+RESULT_DTYPE = numpy.dtype([("clss", "<i4"), ("yp", "<i4"),
+                            ("r1", "<f4"), ("r5", "<f4")])
+
+"""Number of results buffered before writing them in binary"""
+BINARY_CHUNK = 4096
+
+"""Kind of the binary containers of models (see Ema.save)"""
+MODEL_KIND = "model"
+
 
 class Ema(object):
     """
@@ -81,7 +102,8 @@ class Ema(object):
     """
 
 
-    def __init__(self, size=None, b=.15, d=.15, w=.01, W=None):
+    def __init__(self, size=None, b=.15, d=.15, w=.01, W=None,
+                 compact_every=1000, engine="csr"):
         """
         It instantiates EMA
 
@@ -91,23 +113,48 @@ class Ema(object):
         @param    d: The margin threshold (default = .15)
         @param    w: The threshold for zeroing weights (default = .01)
         @param    W: An initial matrix of weights, superseedes size
+        @param compact_every: Number of updates between two removals of the
+                  dropped weights from W (default = 1000, None = never)
+        @param engine: How W is stored, either the name of one of
+                  pyema.weights.ENGINES or a class like those (default =
+                  "csr")
         """
+        if isinstance(engine, basestring):
+            if engine not in ENGINES:
+                raise ValueError("Unknown engine: {!r}".format(engine))
+            engine = ENGINES[engine]
+        self._engine = engine
         self._b = b
         self._d = d
         self._w = w
-        if W is None and size is not None:
-            W = lil_matrix(size)
+        self._compact_every = compact_every
+        self._updates = 0
+        self._reserved = None
+        if W is not None or size is not None:
+            W = engine(size=size, W=W)
         self._W = W
 
 
     def _gen_default_W(self):
-        self._W = lil_matrix((1, 1))
+        self._W = self._engine((1, 1))
+        if self._reserved is not None:
+            self._W.reserve(*self._reserved)
+
+
+    def reserve(self, features, classes):
+        """
+        It makes room in W for the given number of features and classes
 
+        W grows by itself whenever new features or classes show up, but
+        knowing its final size in advance saves laying it out again.
 
-    def _get_s(self, x):
+        @param features: The number of features to make room for
+        @param  classes: The number of classes to make room for
+        """
         if self._W is None:
-            return lil_matrix((1, 1))
-        return x * self._W
+            self._reserved = (features, classes)
+        else:
+            self._W.reserve(features, classes)
 
 
     def predict(self, x):
@@ -118,32 +165,281 @@ class Ema(object):
         @type  x: A scipy.sparse matrix with a single row
         @returns: The predicted class
         """
-        ranking = self.predict_rank(x)
+        ranking = self.predict_rank(x, 1)
         # Default class when there is none = 0
         return ranking[0] if ranking else 0
 
 
-    def predict_rank(self, x):
+    def predict_rank(self, x, k=None):
         """
         It returns the classes ranked by their likehood predicted by features x
 
         @param x: The array of features
         @type  x: A scipy.sparse matrix with a single row
+        @param k: The maximum number of classes to return (default = all)
         @returns: A list of predicted classes starting from the most likely
         """
         if self._W is None:
             return []  # Default class when there is none
 
-        if x.shape != (1, self.W.shape[1]):
+        if x.shape[1] > self._W.shape[0]:
             x = self.prepare_x(x)
+        x = x.tocsr()
+
+        return self._rank(*self._W.scores(x.indices, x.data), k=k)
+
+
+    def predict_rank_indices(self, f, k=None):
+        """
+        It returns the classes ranked by their likehood predicted by features
+
+        It is equivalent to predict_rank(x) for a binary vector x, but it
+        does not need to build x.
+
+        @param f: The indexes (starting by 0) of the active features
+        @type  f: A sequence of naturals
+        @param k: The maximum number of classes to return (default = all)
+        @returns: A list of predicted classes starting from the most likely
+        """
+        if self._W is None:
+            return []  # Default class when there is none
+
+        f = numpy.asarray(f, dtype=numpy.intc)
+        f = f[f < self._W.shape[0]]
+        return self._rank(*self._W.scores(f, numpy.ones(len(f))), k=k)
+
+
+    def predict_rank_batch(self, X, k):
+        """
+        It returns the k most likely classes for several feature vectors
 
-        s = self._get_s(x)
-        return (s.indices[s.data.argsort()[::-1]] + 1).astype(int).tolist()
+        All the vectors are scored together with a single product.
+
+        @param X: The feature vectors, one per row, or the indexes (starting
+                  by 0) of the active features of every binary vector
+        @type  X: A scipy.sparse matrix or a list of sequences of naturals
+        @param k: The number of classes to return per vector
+        @returns: The k most likely classes of every vector, starting from
+                  the most likely one and padded with the default class 0
+        @rtype  : A numpy.array with shape (len(X), k)
+        """
+        if isspmatrix(X):
+            n = X.shape[0]
+        else:
+            n = len(X)
+        ranking = numpy.zeros((n, k), dtype=int)
+        if self._W is None or k <= 0:
+            return ranking  # Default class when there is none
+
+        nrow = self._W.shape[0]
+        if isspmatrix(X):
+            X = X.tocsr()
+            if X.shape[1] > nrow:
+                X = X[:, :nrow]
+            X = csr_matrix((X.data, X.indices, X.indptr), (n, nrow))
+        else:
+            f = [numpy.asarray(ff, dtype=numpy.intc) for ff in X]
+            f = [ff[ff < nrow] for ff in f]
+            indptr = numpy.zeros(n + 1, dtype=numpy.intc)
+            numpy.cumsum([len(ff) for ff in f], out=indptr[1:])
+            X = csr_matrix((numpy.ones(indptr[-1]),
+                            numpy.concatenate(f or [[]]), indptr), (n, nrow))
+
+        S = self._W.scores_batch(X)
+        rows = numpy.repeat(numpy.arange(n), numpy.diff(S.indptr))
+        nz = S.data != 0
+        rows, classes, scores = rows[nz], S.indices[nz], S.data[nz]
+        # By row, by score and, in case of ties, latest classes first
+        order = numpy.lexsort((classes, scores, -rows))[::-1]
+        rows, classes = rows[order], classes[order]
+        counts = numpy.bincount(rows, minlength=n)
+        rank = numpy.arange(len(rows)) - (numpy.cumsum(counts) - counts)[rows]
+        top = rank < k
+        ranking[rows[top], rank[top]] = classes[top] + 1
+        return ranking
+
+
+    def predict_and_learn(self, x, y, k=None):
+        """
+        It predicts the classes for features x and then it learns from them
+
+        It is equivalent to calling predict_rank(x) and then learn(x, y),
+        but the scores of the classes are only computed once.
+
+        @param x: The vector of features of the class
+        @type  x: A scipy.sparse matrix with a single row
+        @param y: The true class of the given features
+        @type  y: A non-zero natural number
+        @param k: The maximum number of classes to return (default = all)
+        @returns: A list of predicted classes starting from the most likely
+        """
+        x = x.tocsr()
+        return self._predict_and_learn(x.indices, x.data, y, x.shape[1], k)
+
+
+    def predict_and_learn_indices(self, f, y, k=None):
+        """
+        It predicts the classes for some features and then it learns from them
+
+        It is equivalent to calling predict_rank_indices(f) and then
+        learn_indices(f, y), but the scores of the classes are only
+        computed once.
+
+        @param f: The indexes (starting by 0) of the active features
+        @type  f: A sequence of naturals
+        @param y: The true class of the given features
+        @type  y: A non-zero natural number
+        @param k: The maximum number of classes to return (default = all)
+        @returns: A list of predicted classes starting from the most likely
+        """
+        f = numpy.asarray(f, dtype=numpy.intc)
+        return self._predict_and_learn(f, numpy.ones(len(f)), y,
+                                       f.max() + 1 if len(f) else 0, k)
+
+
+    def _predict_and_learn(self, f, v, y, len_x, k=None):
+        if self._W is None:
+            self._learn(f, v, y, len_x)
+            return []  # Default class when there is none
+
+        known = f < self._W.shape[0]
+        classes, scores = self._W.scores(f[known], v[known])
+        ranking = self._rank(classes, scores, k)
+        # The score of the true class is the same one learn would look up
+        sy = scores[classes == y - 1]
+        self._learn(f, v, y, len_x, sy[0] if len(sy) else 0.)
+        return ranking
+
+
+    def _rank(self, classes, scores, k=None):
+        """It returns the (k best) given classes sorted by their scores"""
+        if k is not None and k < len(scores):
+            if k <= 0:
+                return []
+            # Only the k best scores (and those tied with them) are sorted
+            kth = numpy.partition(scores, len(scores) - k)[len(scores) - k]
+            best = scores >= kth
+            classes = classes[best]
+            scores = scores[best]
+        # Ties are broken in favour of the latest classes
+        order = numpy.lexsort((classes, scores))[::-1][:k]
+        return (classes[order] + 1).astype(int).tolist()
+
+
+    def get_state(self):
+        """
+        It returns what must be saved to restore the model (see from_state)
+
+        @returns: The parameters of EMA (and the sizes of W), and the named
+                  arrays of W, which later learning does not modify
+        @rtype  : (dict, [(str, numpy.array)])
+        @raises ValueError: If the engine of W is not in pyema.weights.ENGINES
+        """
+        if self.engine is None:
+            raise ValueError("Cannot save W stored by {!r}".format(
+                    self._engine))
+        meta = {"b": self._b, "d": self._d, "w": self._w,
+                "compact_every": self._compact_every,
+                "updates": self._updates, "reserved": self._reserved,
+                "engine": self.engine, "weights": None}
+        arrays = []
+        if self._W is not None:
+            (meta["weights"], arrays) = self._W.get_state()
+        return (meta, arrays)
+
+
+    def snapshot(self):
+        """
+        It returns a copy of the model which later learning does not modify
+
+        The copy must only be used to predict. How much it costs depends on
+        the engine of W (see the snapshot method of the engines).
+
+        @rtype  : Ema
+        """
+        ema = self.__class__(b=self._b, d=self._d, w=self._w,
+                             compact_every=self._compact_every,
+                             engine=self._engine)
+        ema._updates = self._updates
+        ema._reserved = self._reserved
+        if self._W is not None:
+            ema._W = self._W.snapshot()
+        return ema
+
+
+    @classmethod
+    def from_state(cls, meta, arrays):
+        """
+        It restores a model from what get_state returned
+
+        @param meta: The parameters of EMA (and the sizes of W)
+        @param arrays: The named arrays of W, which are used without copying
+        @type  arrays: {str: numpy.array}
+        @rtype  : Ema
+        """
+        ema = cls(b=meta["b"], d=meta["d"], w=meta["w"],
+                  compact_every=meta["compact_every"], engine=meta["engine"])
+        ema._updates = meta["updates"]
+        if meta["reserved"] is not None:
+            ema._reserved = tuple(meta["reserved"])
+        if meta["weights"] is not None:
+            ema._W = ema._engine.from_state(meta["weights"], arrays)
+        return ema
+
+
+    def save(self, f):
+        """
+        It writes the model into a binary container (see pyema.arrayfile)
+
+        It holds the parameters of EMA and the arrays of W, so that
+        Ema.load can map them in memory instead of learning W again.
+
+        @param f: The file (or its name) to write the model to
+        @raises ValueError: If the engine of W is not in pyema.weights.ENGINES
+        """
+        (meta, arrays) = self.get_state()
+        arrayfile.save(f, MODEL_KIND, arrays, meta)
+
+
+    @classmethod
+    def load(cls, f, mmap=True):
+        """
+        It reads a model written by Ema.save
+
+        With mmap, the arrays of W are mapped in memory copy-on-write, so
+        the model is ready at once and learning does not modify the file.
+
+        @param f: The file (or its name) to read the model from
+        @param mmap: Whether to map W in memory instead of reading it
+        @rtype  : Ema
+        @raises ValueError: If f is not a saved model
+        """
+        (kind, meta, arrays) = arrayfile.load(f, mmap, mode="c")
+        if kind != MODEL_KIND:
+            raise ValueError("Not a model but a {!r}".format(kind))
+        return cls.from_state(meta, arrays)
+
+
+    def get_engine(self):
+        """
+        It returns the name of the engine of W (None if it is not one of
+        pyema.weights.ENGINES)
+        """
+        names = [n for (n, e) in ENGINES.iteritems() if e is self._engine]
+        return names[0] if names else None
+    engine = property(get_engine)
 
 
     def get_W(self):
-        """It returns the current matrix of weights W"""
-        return self._W
+        """
+        It returns a copy of the current matrix of weights W
+
+        The copy has no stored zeros and later learning does not modify it,
+        whatever the engine of W.
+        """
+        if self._W is None:
+            return None
+        return self._W.matrix
     W = property(get_W)
 
 
@@ -160,13 +456,14 @@ class Ema(object):
         @rtype  : An sparse matrix with (1, M) shape, where W.shape = (M, _)
         """
         len_x = x.shape[1]
-        if self.W is not None and self.W.shape[0] != len_x:
-            length = self.W.shape[0]
-            ff = numpy.where(x.todense() != 0)[1].tolist()[0]
-            ff = [f for f in ff if f < length]
-            xx = coo_matrix((numpy.ones(len(ff)), (numpy.zeros(len(ff)), ff)),
+        if self._W is not None and self._W.shape[0] != len_x:
+            length = self._W.shape[0]
+            # Only the stored elements of x are looked at
+            x = x.tocsr()
+            keep = (x.indices < length) & (x.data != 0)
+            xx = csr_matrix((x.data[keep], x.indices[keep],
+                             [0, numpy.count_nonzero(keep)]),
                             shape=(1, length))
-            xx = xx.tocsr()
         else:
             xx = x
         return xx
@@ -181,6 +478,37 @@ class Ema(object):
         @param y: The true class of the given features
         @type  y: A non-zero natural number
         """
+        x = x.tocsr()
+        return self._learn(x.indices, x.data, y, x.shape[1])
+
+
+    def learn_indices(self, f, y):
+        """
+        It runs a single learning iteration of EMA
+
+        It is equivalent to learn(x, y) for a binary vector x, but it does
+        not need to build x.
+
+        @param f: The indexes (starting by 0) of the active features
+        @type  f: A sequence of naturals
+        @param y: The true class of the given features
+        @type  y: A non-zero natural number
+        """
+        f = numpy.asarray(f, dtype=numpy.intc)
+        return self._learn(f, numpy.ones(len(f)), y,
+                           f.max() + 1 if len(f) else 0)
+
+
+    def _learn(self, f, v, y, len_x, sy=None):
+        """
+        It runs a single learning iteration of EMA
+
+        @param     f: The indexes of the active features
+        @param     v: The values of the active features
+        @param     y: The true class of the given features
+        @param len_x: The number of features x may have
+        @param    sy: The score of the true class, if already known
+        """
         first_time = False
         if self._W is None:
             self._gen_default_W()
@@ -191,36 +519,26 @@ class Ema(object):
         updated = False
 
         # 0. Increase the shape of W to x and y
-        if x.shape[1] > size[0]:
-            nrow = x.shape[1]
+        if len_x > size[0]:
+            nrow = len_x
         if y > size[1]:
             ncol = y
         if (nrow, ncol) != size:
             LOG.debug("Resizing W to {!r}".format((nrow, ncol)))
-            if isinstance(W, csr_matrix):
-                W.eliminate_zeros()
-            aux = W.tocoo()
-            N = coo_matrix((aux.data, (aux.row, aux.col)), (nrow, ncol))
-            W = N.tocsr()
-            self._W = W
-
-        s = 0.
+            W.resize(nrow, ncol)
+
         scp = 0.
-        sy = 0.
         dx = 0.
         if not first_time:
             # i.e., if we know anything at all to predict
 
-            x = x.tocsr()
-
-            # 1. Score
-            s = (x * W).todense()
-            sy = s[0, y - 1]
+            # 1. Score of the true class
+            if sy is None:
+                sy = W.lookup(f, v, y - 1)
 
             # 2. Compute margin
-            # 2.a Compute scp
-            s[0, y - 1] = 0
-            scp = s.sum()
+            # 2.a Compute scp from the cached sums of the rows of W
+            scp = W.total(f, v) - sy
 
             # 2.c Compute margin
             dx = sy - scp
@@ -231,91 +549,70 @@ class Ema(object):
             updated = True
 
             # 3.1 Decay active features
-            f = x.nonzero()[1]
-            x2 = None
-            if isinstance(x, csr_matrix):
-                x2 = x.copy()
-            else:
-                x2 = x.tocsr()
             # It is more efficient to do ops to non-zero elements this way
-            x2d = x2.data
-            x2d **= 2
+            x2d = v ** 2
             x2d *= -self._b
             x2d += 1
-
-            #diag = numpy.ones(W.shape[0])
-            #for i in range(len(f)):
-            #    diag[f[i]] = x2d[i]
-            #prod = spdiags(diag, [0], W.shape[0], W.shape[0])
-            #
-            #W = prod*W
-
-            for i in xrange(len(f)):
-                j = f[i]
-                W.data[W.indptr[j]:W.indptr[j + 1]] *= x2d[i]
+            W.decay(f, x2d)
 
             # 3.2 Boost true class
-            #for i in f:
-            #    W[i, y-1] += x[0, i]*self._b
-            tmp = x.tocoo()
-            row = tmp.col
-            col = [y - 1] * len(f)
-            B = coo_matrix((tmp.data, (row, col)), shape=W.shape)
-            B = B.tocsr()
-            W = B + W
-
-            # 3.3 Drop small wegihts
-            w = self._w
-            count = 0
-            data = W.data
-            sel = data < w
-            W.data[sel] = 0.
-            if numpy.any(sel):
-                if LOG.isEnabledFor(logging.DEBUG):
-                    LOG.debug("Removing zeros (Count:{};\tnnz:{})".format(
-                            count, W.nnz))
-                #previous = W.nnz
-                W.eliminate_zeros()
-                #if previous == W.nnz:
-                #    LOG.error("""We couldn't remove internal zeros from \
-                #            the sparse matrix""")
-            self._W = W
+            W.boost(f, v, y - 1)
+
+            # 3.3 Drop small wegihts (only the rows just updated)
+            W.prune(f, self._w)
+            self._updates += 1
+            if self._compact_every and \
+                    self._updates % self._compact_every == 0:
+                W.compact()
         return updated
 
 
 
-def process_dataset(dataset, limit=None, size=None, write=None, stdout=None):
+def stream_dataset(dataset, limit=None, size=None, engine="csr",
+                   metrics=(), reserve=None, params=None, checkpoint=None,
+                   resume=None):
     """
-    It applies EMA to an encoded file with binary features
-
-    Every entry in dataset must be of the form:
-        (true_class, active_features)
-    where true class is a non-zero natural and active_features are a list of
-    non-zero natural representing the indexes of the active features.
-
-    For instance, the following is a correct example of dataset entry:
-        ( 3, [1, 2, 5])
+    It applies EMA to an encoded file with binary features, one entry a time
 
-    The returned matrix contains these values per entry:
+    It is the generator behind process_dataset, so see process_dataset for
+    the format of dataset and of the results.
 
-    clss - True class
-      yp - Predicted class
-      r1 - R1 measure
-      r5 - R5 measure
-
-    @returns: A matrix of results during the prediction and learning process
-    @rtype  : [[clss, yp, r1, r5]]
+    @returns: A generator of [clss, yp, r1, r5] results
     @param dataset: An iterable over the dataset
     @param limit: Maximum number of entries to process
     @param size: Initial size for the W matrix of weights
-    @param write: Stream where to write the results to
+    @param engine: How Ema stores its matrix of weights
+    @param metrics: Metrics (see pyema.metrics) updated with every ranking
+    @param reserve: Number of features and classes to make room for in W
+    @param params: Other arguments of Ema, e.g. b, d and w
+    @param checkpoint: Writer of the checkpoints of the run (see
+                       pyema.checkpoint.Checkpointer)
+    @param resume: Checkpoint to go on from (see
+                   pyema.checkpoint.load_checkpoint), dataset must start
+                   right after its last event
     @type  size: (rows, columns)
     """
-    results = []
-    ema = Ema(size=size)
-    len_x = 0
-    if size is not None:
-        len_x = size[0]
+    if isinstance(dataset, basestring):
+        dataset = load_binary(dataset)[0]
+    if isinstance(dataset, Dataset):
+        dataset = events(dataset)
+    done = 0
+    if resume is not None:
+        names = [state.get("name") for state in resume.metrics]
+        if names != [metric.name for metric in metrics]:
+            raise ValueError("The checkpoint has metrics {}, not {}".format(
+                    names, [metric.name for metric in metrics]))
+        ema = resume.ema
+        done = resume.events
+        for (metric, state) in zip(metrics, resume.metrics):
+            metric.set_state(state)
+    else:
+        ema = Ema(size=size, engine=engine, **(params or {}))
+        if reserve:
+            ema.reserve(*reserve)
+    k = depth(metrics)
+    if k is not None:
+        k = max(k, 5)
     iteration = 0
     gen = dataset
     for (clss, fs) in gen:
@@ -323,48 +620,138 @@ def process_dataset(dataset, limit=None, size=None, write=None, stdout=None):
         if limit and iteration > limit:
             break
 
-        # Encode x
-        # - Trying to minimize the number of times W need to be resized
-        m = max(fs)
-        len_x = max(m, len_x)
-        ff = [f - 1 for f in fs]
-        x = coo_matrix((numpy.ones(len(fs)), (numpy.zeros(len(fs)), ff)),
-                       shape=(1, len_x))
-        x = x.tocsr()
+        # Indexes of the active features (x is binary)
+        ff = numpy.asarray(fs, dtype=numpy.intc) - 1
 
-        # Predict
-        class_ranking = ema.predict_rank(x)
+        # Predict (and learn)
+        class_ranking = ema.predict_and_learn_indices(ff, clss, k)
         yp = class_ranking[0] if class_ranking else 0
         r1 = 1. if yp == clss else 0.
         r5 = 1. if clss in class_ranking[0:min(len(class_ranking), 5)] else 0.
         assert r5 >= r1
+        for metric in metrics:
+            metric.update(class_ranking, clss)
+        if checkpoint is not None and checkpoint.due(done + iteration):
+            checkpoint.save(ema, done + iteration, metrics)
 
-        # Store results
-        entry = [clss, yp, r1, r5]
         if LOG.isEnabledFor(logging.DEBUG):
             LOG.debug("True class:{:d};\tPred. class:{:d}".format(
                     clss, yp))
-        results.append(entry)
+        yield [clss, yp, r1, r5]
+
+    if checkpoint is not None:
+        checkpoint.save(ema, done + min(iteration, limit or iteration),
+                        metrics)
+        checkpoint.close()
+
+
+
+def process_dataset(dataset, limit=None, size=None, write=None, stdout=None,
+                    engine="csr", binary=None, keep=True, metrics=(),
+                    report=None, reserve=None, params=None, checkpoint=None,
+                    resume=None):
+    """
+    It applies EMA to an encoded file with binary features
+
+    Every entry in dataset must be of the form:
+        (true_class, active_features)
+    where true class is a non-zero natural and active_features are a list of
+    non-zero natural representing the indexes of the active features.
+
+    For instance, the following is a correct example of dataset entry:
+        ( 3, [1, 2, 5])
+
+    A Dataset of arrays (see pyema.dataset), or the name of a binary
+    container of one, is processed without building such entries.
+
+    The returned matrix contains these values per entry:
 
-        # Learn
-        ema.learn(x, clss)
+    clss - True class
+      yp - Predicted class
+      r1 - R1 measure
+      r5 - R5 measure
+
+    Results are written as soon as they are produced, so memory stays
+    constant when they are not kept.
 
-    if write:
-        for entry in results:
+    @returns: A matrix of results during the prediction and learning process
+              (None if they are not kept)
+    @rtype  : [[clss, yp, r1, r5]]
+    @param dataset: An iterable over the dataset
+    @param limit: Maximum number of entries to process
+    @param size: Initial size for the W matrix of weights
+    @param write: Stream where to write the results to
+    @param stdout: Stream where to write the mean R1 and R5 to
+    @param engine: How Ema stores its matrix of weights
+    @param binary: Stream where to write the results to as RESULT_DTYPE
+                   records (see read_results)
+    @param keep: Whether to return the matrix of results
+    @param metrics: Additional metrics (see pyema.metrics) written to stdout
+                    after R1 and R5
+    @param report: Number of entries between logs of the current metrics
+    @param reserve: Number of features and classes to make room for in W,
+                    e.g. from the index of the dataset
+    @param params: Other arguments of Ema, e.g. b, d and w
+    @param checkpoint: Writer of the checkpoints of the run (see
+                       pyema.checkpoint.Checkpointer)
+    @param resume: Checkpoint to go on from (see
+                   pyema.checkpoint.load_checkpoint), dataset must start
+                   right after its last event. Only the results after it
+                   are written, but R1, R5 and the metrics cover the whole
+                   run.
+    @type  size: (rows, columns)
+    """
+    results = [] if keep else None
+    count = 0
+    recalls = [RecallAtK(1), RecallAtK(5)]
+    metrics = recalls + list(metrics)
+    buf = None
+    if binary is not None:
+        buf = numpy.empty(BINARY_CHUNK, dtype=RESULT_DTYPE)
+    for entry in stream_dataset(dataset, limit, size, engine, metrics,
+                                reserve, params, checkpoint, resume):
+        if keep:
+            results.append(entry)
+        if write:
             try:
                 write.write(" {:g} {:g} {:g} {:g}\n".format(*entry))
             except ValueError as e:
                 LOG.error("Error writting this entry: {!r}".format(entry))
                 raise e
+        if buf is not None:
+            buf[count % BINARY_CHUNK] = tuple(entry)
+            if count % BINARY_CHUNK == BINARY_CHUNK - 1:
+                binary.write(buf.tostring())
+        count += 1
+        if report and count % report == 0:
+            LOG.info("{:d} entries: {:s}".format(
+                    count, " ".join(str(m) for m in metrics)))
+
+    if buf is not None:
+        binary.write(buf[:count % BINARY_CHUNK].tostring())
 
     if stdout is not None:
-        mean = numpy.mean(numpy.array(results)[:, 2:], 0).tolist()
-        stdout.write("{:g}\t{:g}\n".format(*mean))
+        stdout.write("{:g}\t{:g}\n".format(*[m.value for m in recalls]))
+        if len(metrics) > len(recalls):
+            stdout.write("\t".join(str(m) for m in metrics[len(recalls):]))
+            stdout.write("\n")
 
     return results
 
 
 
+def read_results(f):
+    """
+    It reads the results written by process_dataset in binary format
+
+    @param f: The file (or its name) the results were written to
+    @returns: The results, with fields clss, yp, r1 and r5
+    @rtype  : A numpy record array of RESULT_DTYPE
+    """
+    return numpy.fromfile(f, dtype=RESULT_DTYPE)
+
+
+
 def file2dataset(f):
     """\
     It processes files into datasets understandable by Ema
@@ -372,12 +759,149 @@ def file2dataset(f):
     Every line in the file should be of the form:
     <class> <num_features> <index_feature_1> ... <index_feature_n>
 
+    Files are parsed in big blocks (see pyema.dataset), other iterables
+    over lines are parsed line by line.
+
     @param f: The file to process into a valid dataset
     @returns: A generator of (<class>, [<index_feature_i>]) tuples
     """
-    for line in f:
-        parts = map(int, line.split())
-        yield (parts[0], parts[2:])
+    if not hasattr(f, "read"):
+        for line in f:
+            parts = map(int, line.split())
+            yield (parts[0], parts[2:])
+        return
+    for (clss, fs) in events(read_blocks(f)):
+        yield (clss, fs.tolist())
+
+
+
+def evaluate_file(f, options, write=None, stdout=None, binary=None):
+    """
+    It processes a dataset file as the ema script does
+
+    @param f: The dataset file (encoded or binary)
+    @param options: The limit, start, shard, index, engine, report and
+                    metrics (as specs) given to the script and, optionally,
+                    checkpoint_every, checkpoint_seconds and resume
+    @type  options: dict
+    @param write: Stream where to write the results to
+    @param stdout: Stream where to write the mean R1 and R5 to
+    @param binary: Stream where to write the results to in binary format
+    @raises ValueError: If the checkpoint to resume from is of another run,
+                        or of a run with another engine
+    """
+    from pyema.checkpoint import Checkpointer, load_checkpoint, \
+            checkpoint_name
+    metrics = [parse_metric(m) for m in options["metrics"]]
+    index = None
+    if options["index"] or options["shard"]:
+        index = load_index(f.name, create=True)
+    (start, count) = (options["start"], options["limit"])
+    if options["shard"]:
+        (k, n) = options["shard"]
+        (start, count) = shards(index["events"], n)[k - 1]
+        if options["limit"]:
+            count = min(count, options["limit"])
+    reserve = (index["features"], index["classes"]) if index else None
+
+    path = checkpoint_name(f.name)
+    checkpoint = None
+    if options.get("checkpoint_every") or options.get("checkpoint_seconds"):
+        checkpoint = Checkpointer(path, options.get("checkpoint_every"),
+                                  options.get("checkpoint_seconds"), start)
+    resume = load_checkpoint(path) if options.get("resume") else None
+    if resume is not None:
+        if resume.start != start:
+            raise ValueError("{:s} is the checkpoint of a run from event {:d}"
+                             .format(path, resume.start))
+        if resume.ema.engine != options["engine"]:
+            raise ValueError("{:s} is the checkpoint of a run with engine "
+                             "{!r}, not {!r}".format(path, resume.ema.engine,
+                                                     options["engine"]))
+        LOG.info("Resuming {:s} after {:d} events".format(f.name,
+                                                         resume.events))
+        start += resume.events
+        if count is not None:
+            count = max(count - resume.events, 0)
+    process_dataset(events(read_dataset(f, start, count, index)),
+            write=write, stdout=stdout, engine=options["engine"],
+            binary=binary, keep=False, metrics=metrics,
+            report=options["report"], reserve=reserve,
+            checkpoint=checkpoint, resume=resume)
+
+
+
+def _evaluate_job(job):
+    """
+    It processes a dataset file in a worker process
+
+    The results are written into temporary files as they come, so the
+    worker does not hold them in memory, and the parent process copies
+    them where they go (see copy_output).
+
+    @param job: The name of the file, the options of evaluate_file and
+                whether to write the results as text and in binary format
+    @returns: The name of the file with the results as text, the summary
+              and the name of the file with the binary results (None for
+              the results not written)
+    @rtype  : (str, str, str)
+    """
+    (name, options, in_text, in_binary) = job
+    stdout = StringIO()
+    outputs = []
+    try:
+        for wanted in (in_text, in_binary):
+            if wanted:
+                (fd, path) = tempfile.mkstemp(prefix="ema-")
+                outputs.append((path, os.fdopen(fd, "wb")))
+            else:
+                outputs.append((None, None))
+        with open(name, "rb") as f:
+            evaluate_file(f, options, outputs[0][1], stdout, outputs[1][1])
+    except:
+        for (path, _) in outputs:
+            if path is not None:
+                os.remove(path)
+        raise
+    finally:
+        for (_, out) in outputs:
+            if out is not None:
+                out.close()
+    return (outputs[0][0], stdout.getvalue(), outputs[1][0])
+
+
+
+def copy_output(name, out):
+    """
+    It copies the results written by a worker process and removes them
+
+    @param name: The name of the file with the results (None = no results)
+    @param out: Stream where to copy them to
+    """
+    if name is None:
+        return
+    try:
+        with open(name, "rb") as inp:
+            shutil.copyfileobj(inp, out)
+    finally:
+        os.remove(name)
+
+
+
+def parse_shard(text):
+    """
+    It parses a shard given as K/N, i.e., the K-th of N shards
+
+    @rtype  : (int, int)
+    @raises argparse.ArgumentTypeError: If it is not a valid shard
+    """
+    try:
+        (k, n) = map(int, text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Not a shard: {!r}".format(text))
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError("Not a shard: {!r}".format(text))
+    return (k, n)
 
 
 
@@ -389,6 +913,7 @@ sssAAAI09_arpa.pdf
 
 It can understand either the following format:
     <class> <num_features> <index_feature_1> ... <index_feature_n>
+or binary containers of it written by ema-convert.
 
 It prints the average R1 and R5 measure over all the given files
 
@@ -403,20 +928,67 @@ Execute as a script with '-h' for details
 
             It can understand either the following format:
                 <class> <num_features> <index_feature_1> ... <index_feature_n>
+            or binary containers of it written by ema-convert.
 
             It prints the average R1 and R5 measure over all the given files
    """)
     parser.add_argument('files',
-            help="Encoded files to process",
-            type=argparse.FileType('r'),
+            help="Encoded files (or binary containers) to process",
+            type=argparse.FileType('rb'),
             metavar="F",
             nargs="+")
     parser.add_argument('-w',
             help="File to write the results to",
             type=argparse.FileType('w'))
+    parser.add_argument('-b',
+            help="File to write the results to in binary format",
+            type=argparse.FileType('wb'))
     parser.add_argument('-l',
             help="Iteration limit",
             type=int)
+    parser.add_argument('-e',
+            help="Engine used to store the matrix of weights",
+            choices=sorted(ENGINES),
+            default="csr")
+    parser.add_argument('-m',
+            help="Additional metric to print, e.g. r@10, mrr, r@1/w500 or "
+                 "r@1/e0.01 (see pyema.metrics)",
+            type=parse_metric,
+            action='append',
+            default=[])
+    parser.add_argument('-r',
+            help="Number of entries between logs of the current metrics",
+            type=int)
+    parser.add_argument('-i',
+            help="Use the sidecar index of every file (built if missing) to "
+                 "presize W and to seek to the first event",
+            action='store_true')
+    parser.add_argument('-s',
+            help="First event to process (starting at 0)",
+            type=int,
+            default=0)
+    parser.add_argument('--shard',
+            help="Only process the K-th of N consecutive shards of every "
+                 "file (implies -i)",
+            type=parse_shard,
+            metavar="K/N")
+    parser.add_argument('--checkpoint-every',
+            help="Number of events between checkpoints of every file, "
+                 "written as <file>.ckpt",
+            type=int,
+            metavar="N")
+    parser.add_argument('--checkpoint-seconds',
+            help="Number of seconds between checkpoints of every file",
+            type=float,
+            metavar="T")
+    parser.add_argument('--resume',
+            help="Go on from the checkpoint of every file, if any (only the "
+                 "results after it are written)",
+            action='store_true')
+    parser.add_argument('-j',
+            help="Number of files processed in parallel",
+            type=int,
+            default=1)
     parser.add_argument('-d',
             help="Debug mode",
             action='store_true')
@@ -441,11 +1013,27 @@ Execute as a script with '-h' for details
         exit(0)
 
     else:
-        results = []
         current_time = time.time()
-        for f in args.files:
-            results.extend(process_dataset(file2dataset(f), args.l,
-                write=args.w, stdout=sys.stdout))
+        options = {"limit": args.l, "start": args.s, "shard": args.shard,
+                   "index": args.i, "engine": args.e, "report": args.r,
+                   "metrics": [m.name for m in args.m],
+                   "checkpoint_every": args.checkpoint_every,
+                   "checkpoint_seconds": args.checkpoint_seconds,
+                   "resume": args.resume}
+        if args.j > 1 and len(args.files) > 1:
+            pool = multiprocessing.Pool(min(args.j, len(args.files)))
+            jobs = [(f.name, options, args.w is not None, args.b is not None)
+                    for f in args.files]
+            # Results come back in the order of the files
+            for (text, summary, binary) in pool.imap(_evaluate_job, jobs):
+                copy_output(text, args.w)
+                sys.stdout.write(summary)
+                copy_output(binary, args.b)
+            pool.close()
+            pool.join()
+        else:
+            for f in args.files:
+                evaluate_file(f, options, args.w, sys.stdout, args.b)
 
         time_spent = time.time() - current_time
         LOG.info("Time spent: {:f} s.".format(time_spent))
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""
+Online metrics for the prequential evaluation of EMA
+
+Every metric is fed, one event a time, with the ranking of classes predicted
+for an event (as returned by Ema.predict_rank) and its true class. Only
+running sums are kept, so metrics can report the current quality of a model
+while events are streamed through it.
+
+Metrics are built from specs (see parse_metric) such as:
+
+    r@5         Recall at 5 (i.e., R5) since the first event
+    mrr         Mean reciprocal rank since the first event
+    mrr@10      Mean reciprocal rank within the top 10 classes
+    r@1/w500    Recall at 1 over the last 500 events
+    r@1/e0.01   Recall at 1 exponentially decayed by 0.01 every event
+"""
+
+import logging
+import re
+
+import numpy
+
+
+__author__ = "José Antonio Martín Baena"
+__email__ = "jose.antonio.martin.baena@gmail.com"
+
+LOG = logging.getLogger("ema.metrics")
+
+
+class Metric(object):
+    """
+    Mean of a score of every event since the first one
+
+    Subclasses define the score of an event from its ranking.
+
+    @ivar name: Spec of the metric
+    @ivar k: Number of classes of the ranking the metric looks at (None if
+             it needs the whole ranking)
+    """
+
+    def __init__(self, name, k=None):
+        self.name = name
+        self.k = k
+        self.count = 0
+        self._sum = 0.
+
+
+    def score(self, ranking, y):
+        """
+        It scores the ranking of a single event
+
+        @param ranking: Classes sorted by decreasing score
+        @param y: True class of the event
+        @type  y: int
+        @rtype  : float
+        """
+        raise NotImplementedError()
+
+
+    def update(self, ranking, y):
+        """
+        It adds an event to the metric
+
+        @param ranking: Classes sorted by decreasing score
+        @param y: True class of the event
+        @returns: The score of the event
+        @rtype  : float
+        """
+        s = self.score(ranking, y)
+        self.count += 1
+        self._sum += s
+        return s
+
+
+    @property
+    def value(self):
+        """Current value of the metric (nan before any event)"""
+        if not self.count:
+            return numpy.nan
+        return self._sum / self.count
+
+
+    def get_state(self):
+        """
+        It returns the name and the running sums of the metric (see
+        set_state)
+
+        @rtype  : A JSON-serialisable dict
+        """
+        return {"name": self.name, "count": self.count, "sum": self._sum}
+
+
+    def set_state(self, state):
+        """It restores the running sums returned by get_state"""
+        self.count = state["count"]
+        self._sum = state["sum"]
+
+
+    def __str__(self):
+        return "{:s}={:g}".format(self.name, self.value)
+
+
+
+class RecallAtK(Metric):
+    """
+    Whether the true class is amongst the first k classes of the ranking
+    """
+
+    def __init__(self, k, name=None):
+        super(RecallAtK, self).__init__(name or "r@{:d}".format(k), k)
+
+
+    def score(self, ranking, y):
+        return 1. if y in ranking[:self.k] else 0.
+
+
+
+class ReciprocalRank(Metric):
+    """
+    Inverse of the position of the true class in the ranking
+
+    The score is 0 if the true class is not amongst the first k classes.
+    """
+
+    def __init__(self, k=None, name=None):
+        if name is None:
+            name = "mrr" if k is None else "mrr@{:d}".format(k)
+        super(ReciprocalRank, self).__init__(name, k)
+
+
+    def score(self, ranking, y):
+        ranking = list(ranking[:self.k])
+        if y not in ranking:
+            return 0.
+        return 1. / (ranking.index(y) + 1)
+
+
+
+class Window(Metric):
+    """
+    Mean of the scores of another metric over the last size events
+
+    It keeps the last size scores in a ring buffer.
+    """
+
+    def __init__(self, metric, size, name=None):
+        super(Window, self).__init__(
+                name or "{:s}/w{:d}".format(metric.name, size), metric.k)
+        self.metric = metric
+        self.size = size
+        self._scores = numpy.zeros(size)
+
+
+    def score(self, ranking, y):
+        return self.metric.score(ranking, y)
+
+
+    def update(self, ranking, y):
+        s = self.score(ranking, y)
+        i = self.count % self.size
+        self._sum += s - self._scores[i]
+        self._scores[i] = s
+        self.count += 1
+        return s
+
+
+    @property
+    def value(self):
+        if not self.count:
+            return numpy.nan
+        return self._sum / min(self.count, self.size)
+
+
+    def get_state(self):
+        state = super(Window, self).get_state()
+        state["scores"] = self._scores.tolist()
+        return state
+
+
+    def set_state(self, state):
+        super(Window, self).set_state(state)
+        self._scores = numpy.array(state["scores"])
+
+
+
+class Ewma(Metric):
+    """
+    Exponentially weighted moving average of the scores of another metric
+
+    Every new score weights alpha and older ones fade by (1 - alpha). The
+    average is corrected for the bias towards 0 of the first events.
+    """
+
+    def __init__(self, metric, alpha, name=None):
+        super(Ewma, self).__init__(
+                name or "{:s}/e{:g}".format(metric.name, alpha), metric.k)
+        self.metric = metric
+        self.alpha = alpha
+        self._weight = 0.
+
+
+    def score(self, ranking, y):
+        return self.metric.score(ranking, y)
+
+
+    def update(self, ranking, y):
+        s = self.score(ranking, y)
+        self._sum += self.alpha * (s - self._sum)
+        self._weight += self.alpha * (1. - self._weight)
+        self.count += 1
+        return s
+
+
+    @property
+    def value(self):
+        if not self.count:
+            return numpy.nan
+        return self._sum / self._weight
+
+
+    def get_state(self):
+        state = super(Ewma, self).get_state()
+        state["weight"] = self._weight
+        return state
+
+
+    def set_state(self, state):
+        super(Ewma, self).set_state(state)
+        self._weight = state["weight"]
+
+
+
+_SPEC = re.compile(r"^(r|mrr)(?:@(\d+))?(?:/(w|e)([0-9.eE+-]+))?$")
+
+
+def parse_metric(spec):
+    """
+    It builds a metric from its spec
+
+    See the documentation of this module for the syntax of specs.
+
+    @param spec: Spec of the metric
+    @type  spec: str
+    @rtype  : Metric
+    @raises ValueError: If the spec is not understood
+    """
+    match = _SPEC.match(spec.strip().lower())
+    if not match:
+        raise ValueError("Unknown metric: {!r}".format(spec))
+    (kind, k, window, param) = match.groups()
+    k = int(k) if k else None
+    if kind == "r":
+        if k is None:
+            raise ValueError("Recall needs a k (e.g. r@5): {!r}".format(spec))
+        metric = RecallAtK(k)
+    else:
+        metric = ReciprocalRank(k)
+    if window == "w":
+        size = int(param)
+        if size < 1:
+            raise ValueError("Window sizes must be 1 or more: {!r}".format(
+                    spec))
+        metric = Window(metric, size)
+    elif window == "e":
+        alpha = float(param)
+        if not 0. < alpha <= 1.:
+            raise ValueError("Alphas must be in (0, 1]: {!r}".format(spec))
+        metric = Ewma(metric, alpha)
+    return metric
+
+
+def depth(metrics):
+    """
+    Number of classes that must be ranked to update all the given metrics
+
+    @param metrics: Metrics to be updated
+    @returns: The maximum k of the metrics (None if any needs every class)
+    """
+    ks = [m.k for m in metrics]
+    if None in ks:
+        return None
+    return max(ks) if ks else 0
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""
+Line-oriented prediction and learning server around Ema
+
+A single process serves many connections with an asyncore event loop.
+Every request is a line and gets a line back, in the same order:
+
+    PREDICT <k> <feature_1> ... <feature_n>     OK <class_1> ... <class_k>
+    LEARN <class> <feature_1> ... <feature_n>   OK
+    STEP <k> <class> <feature_1> ... <feature_n>
+                                                OK <class_1> ... <class_k>
+    QUIT                                        (connection closed)
+
+Features and classes start by 1, as in encoded files, and STEP predicts the
+k most likely classes before learning the true one. Wrong requests get an
+"ERR <message>" line.
+
+PREDICT requests are not answered at once, but queued until either the
+oldest one has waited for the latency budget or there are max_batch of
+them. Then all of them are scored with a single Ema.predict_rank_batch
+call. Queued predictions are answered before any request which changes
+the model, so they always see the model as it was when they arrived.
+"""
+
+import argparse
+import asynchat
+import asyncore
+import logging
+import socket
+import time
+
+import numpy
+
+from pyema.ema import Ema
+from pyema.weights import ENGINES
+
+
+__author__ = "José Antonio Martín Baena"
+__email__ = "jose.antonio.martin.baena@gmail.com"
+
+LOG = logging.getLogger("ema.server")
+
+"""Default time (in seconds) a prediction may wait to be batched"""
+LATENCY_BUDGET = .002
+
+"""Default maximum number of predictions scored together"""
+MAX_BATCH = 64
+
+"""Maximum length of a request line"""
+MAX_LINE = 1 << 16
+
+
+class EmaServer(asyncore.dispatcher):
+    """
+    Server of the predictions and the learning of a model
+
+    For instance, to serve a saved model on port 7070:
+
+    >>> server = EmaServer(Ema.load("model.ema"), ("localhost", 7070))
+    >>> server.serve_forever()
+    """
+
+    def __init__(self, ema, address=("localhost", 0),
+                 budget=LATENCY_BUDGET, max_batch=MAX_BATCH):
+        """
+        @param ema: The model to serve
+        @param address: The (host, port) to listen to (port 0 = any free one)
+        @param budget: Time (in seconds) a prediction may wait to be batched
+        @param max_batch: Maximum number of predictions scored together
+        """
+        self._map = {}
+        asyncore.dispatcher.__init__(self, map=self._map)
+        self.ema = ema
+        self.budget = budget
+        self.max_batch = max_batch
+        self._pending = []
+        self._deadline = None
+        self._running = False
+        self.batches = 0
+        self.predictions = 0
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(128)
+
+
+    def get_address(self):
+        """It returns the (host, port) the server listens to"""
+        return self.socket.getsockname()
+    address = property(get_address)
+
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            _Channel(self, pair[0])
+
+
+    def predict(self, channel, k, f):
+        """It queues a prediction of the k best classes for features f"""
+        if not self._pending:
+            self._deadline = time.time() + self.budget
+        self._pending.append((channel, k, f))
+        if len(self._pending) >= self.max_batch:
+            self.flush()
+
+
+    def flush(self):
+        """It answers every queued prediction with a single batch"""
+        if not self._pending:
+            return
+        (pending, self._pending) = (self._pending, [])
+        self._deadline = None
+        k = max(k for (_, k, _) in pending)
+        ranking = self.ema.predict_rank_batch([f for (_, _, f) in pending], k)
+        for ((channel, k, _), row) in zip(pending, ranking.tolist()):
+            if channel.connected:
+                channel.reply([c for c in row[:k] if c])
+        self.batches += 1
+        self.predictions += len(pending)
+
+
+    def learn(self, y, f):
+        """It learns class y for features f, after the queued predictions"""
+        self.flush()
+        self.ema.learn_indices(f, y)
+
+
+    def step(self, k, y, f):
+        """It predicts the k best classes for f and then learns class y"""
+        self.flush()
+        return self.ema.predict_and_learn_indices(f, y, k)
+
+
+    def poll(self, timeout=None):
+        """
+        It serves the requests which arrive within timeout seconds
+
+        The wait is shortened so that queued predictions do not exceed the
+        latency budget.
+        """
+        if self._deadline is not None:
+            wait = max(self._deadline - time.time(), 0.)
+            timeout = wait if timeout is None else min(timeout, wait)
+        asyncore.loop(timeout=timeout, map=self._map, count=1)
+        if self._deadline is not None and time.time() >= self._deadline:
+            self.flush()
+
+
+    def serve_forever(self, poll_interval=.5):
+        """It serves requests until stop is called"""
+        self._running = True
+        while self._running:
+            self.poll(poll_interval)
+        self.flush()
+
+
+    def stop(self):
+        """It makes serve_forever return (after its current poll)"""
+        self._running = False
+
+
+    def close_all(self):
+        """It closes the server and every connection"""
+        asyncore.close_all(map=self._map)
+
+
+
+class _Channel(asynchat.async_chat):
+    """Connection of a client, whose requests are parsed line by line"""
+
+    def __init__(self, server, sock):
+        asynchat.async_chat.__init__(self, sock, map=server._map)
+        self.server = server
+        self._buffer = []
+        self._size = 0
+        self.set_terminator("\n")
+
+
+    def collect_incoming_data(self, data):
+        self._size += len(data)
+        if self._size > MAX_LINE:
+            self.server.flush()
+            self.push("ERR line too long\n")
+            self.close_when_done()
+            return
+        self._buffer.append(data)
+
+
+    def found_terminator(self):
+        line = "".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        parts = line.split()
+        if not parts:
+            return
+        command = parts[0].upper()
+        if command != "PREDICT":
+            # Replies go in the same order as requests, so the queued
+            # predictions are answered first
+            self.server.flush()
+        try:
+            args = [int(p) for p in parts[1:]]
+            if command == "PREDICT":
+                (k, f) = (args[0], self._features(args[1:]))
+                self._natural(k)
+                self.server.predict(self, k, f)
+            elif command == "LEARN":
+                (y, f) = (args[0], self._features(args[1:]))
+                self._positive(y)
+                self.server.learn(y, f)
+                self.push("OK\n")
+            elif command == "STEP":
+                (k, y, f) = (args[0], args[1], self._features(args[2:]))
+                self._natural(k)
+                self._positive(y)
+                self.reply(self.server.step(k, y, f))
+            elif command == "QUIT":
+                self.close_when_done()
+            else:
+                self.push("ERR unknown command {:s}\n".format(parts[0]))
+        except (ValueError, IndexError) as e:
+            self.server.flush()
+            self.push("ERR wrong request: {!s}\n".format(e))
+
+
+    def reply(self, classes):
+        """It answers a request with a ranking of classes"""
+        self.push(" ".join(["OK"] + [str(c) for c in classes]) + "\n")
+
+
+    @staticmethod
+    def _features(ids):
+        """It turns 1-based feature ids into 0-based indexes"""
+        f = numpy.array(ids, dtype=numpy.intc) - 1
+        if (f < 0).any():
+            raise ValueError("features start by 1")
+        return f
+
+
+    @staticmethod
+    def _positive(y):
+        """It checks that y is a class"""
+        if y < 1:
+            raise ValueError("classes start by 1")
+
+
+    @staticmethod
+    def _natural(k):
+        """It checks that k is a number of classes"""
+        if k < 0:
+            raise ValueError("negative number of classes")
+
+
+    def handle_error(self):
+        LOG.exception("Error serving a client")
+        self.close()
+
+
+
+def main():
+    """\
+It serves the predictions and the learning of EMA
+
+Execute as a script with '-h' for details
+   """
+    parser = argparse.ArgumentParser(description="""\
+            It serves the predictions and the learning of EMA through a
+            line-oriented protocol (see pyema.server)""")
+    parser.add_argument('-H',
+            help="Host to listen to",
+            default="localhost")
+    parser.add_argument('-p',
+            help="Port to listen to",
+            type=int,
+            default=7070)
+    parser.add_argument('-m',
+            help="Saved model to serve (see Ema.save), a new one otherwise")
+    parser.add_argument('-e',
+            help="Engine used to store the matrix of weights of a new model",
+            choices=sorted(ENGINES),
+            default="rows")
+    parser.add_argument('-b',
+            help="Time (in milliseconds) a prediction may wait to be batched",
+            type=float,
+            default=LATENCY_BUDGET * 1000)
+    parser.add_argument('--max-batch',
+            help="Maximum number of predictions scored together",
+            type=int,
+            default=MAX_BATCH)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    ema = Ema.load(args.m) if args.m else Ema(engine=args.e)
+    server = EmaServer(ema, (args.H, args.p), args.b / 1000., args.max_batch)
+    LOG.info("Serving on {:s}:{:d}".format(*server.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close_all()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""
+Model shared by several processes through memory-mapped files
+
+A single writer process publishes generations of a model into a directory:
+every generation is a saved model (see Ema.save) and a file named CURRENT
+holds the name of the last one. Both are written into a temporary file
+which is then renamed, so readers never see half a generation.
+
+Any number of reader processes map the last generation in memory (see
+Ema.load) instead of reading it, so all of them share the same pages of W
+through the page cache rather than holding a copy each. Readers look for
+a newer generation every some seconds.
+
+Only the csr and scaled engines are mapped as they are; the rows engine
+rebuilds its rows when a generation is loaded.
+"""
+
+import logging
+import os
+import re
+import time
+
+from pyema.ema import Ema
+from pyema.snapshot import Snapshot
+
+
+__author__ = "José Antonio Martín Baena"
+__email__ = "jose.antonio.martin.baena@gmail.com"
+
+LOG = logging.getLogger("ema.shared")
+
+"""Name of the file which points to the last generation"""
+CURRENT = "CURRENT"
+
+"""Number of generations kept for the readers which are still using them"""
+KEEP_GENERATIONS = 3
+
+"""Default time (in seconds) between two looks for a newer generation"""
+REFRESH_INTERVAL = 1.
+
+_GENERATION = re.compile(r"^generation-(\d+)\.ema$")
+
+
+def generation_name(generation):
+    """It returns the name of the file of the given generation"""
+    return "generation-{:08d}.ema".format(generation)
+
+
+def current_generation(directory):
+    """
+    It returns the last generation published into a directory
+
+    @returns: The number and the file name of the generation (None if
+              there is none)
+    @rtype  : (int, str)
+    """
+    try:
+        with open(os.path.join(directory, CURRENT)) as inp:
+            name = inp.read().strip()
+    except IOError:
+        return None
+    match = _GENERATION.match(name)
+    if not match:
+        raise ValueError("Wrong {:s} in {:s}: {!r}".format(
+                CURRENT, directory, name))
+    return (int(match.group(1)), os.path.join(directory, name))
+
+
+def _replace(path, write):
+    """It writes a file into a temporary one and renames it"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as out:
+        write(out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.rename(tmp, path)
+
+
+
+class SharedWriter(object):
+    """
+    Publisher of the generations of a model
+
+    For instance, to publish a new generation every 10000 events:
+
+    >>> writer = SharedWriter("/dev/shm/model")
+    >>> for (i, (clss, fs)) in enumerate(dataset):
+    ...     ema.learn_indices(fs, clss)
+    ...     if (i + 1) % 10000 == 0:
+    ...         writer.publish(ema)
+    """
+
+    def __init__(self, directory, keep=KEEP_GENERATIONS):
+        """
+        @param directory: The directory to publish into (created if needed)
+        @param keep: The number of generations kept (at least 1)
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.keep = max(keep, 1)
+        current = current_generation(directory)
+        self.generation = current[0] if current else 0
+
+
+    def publish(self, ema):
+        """
+        It publishes a new generation of a model
+
+        @param ema: The model
+        @returns: The number of the new generation
+        @raises IOError, OSError: If it could not be written
+        """
+        generation = self.generation + 1
+        name = generation_name(generation)
+        _replace(os.path.join(self.directory, name), ema.save)
+        _replace(os.path.join(self.directory, CURRENT),
+                 lambda out: out.write(name + "\n"))
+        self.generation = generation
+        LOG.debug("Published generation {:d}".format(generation))
+        self._remove_old()
+        return generation
+
+
+    def _remove_old(self):
+        """It removes all the generations but the last keep ones"""
+        for name in os.listdir(self.directory):
+            match = _GENERATION.match(name)
+            if match and int(match.group(1)) <= self.generation - self.keep:
+                # Readers which have it mapped keep it until they let it go
+                os.remove(os.path.join(self.directory, name))
+
+
+
+class SharedReader(object):
+    """
+    Model predicting from the last generation published into a directory
+
+    For instance, in every worker process:
+
+    >>> model = SharedReader("/dev/shm/model")
+    >>> model.predict_rank_indices([0, 4], 5)
+    """
+
+    def __init__(self, directory, interval=REFRESH_INTERVAL):
+        """
+        @param directory: The directory the generations are published into
+        @param interval: The time (in seconds) between two looks for a
+                  newer generation (0 = before every prediction)
+        """
+        self.directory = directory
+        self.interval = interval
+        self._snapshot = Snapshot(0, Ema())
+        self.refresh()
+
+
+    def refresh(self):
+        """
+        It maps the last generation, if it is not mapped already
+
+        @returns: Whether a newer generation has been mapped
+        @raises IOError, OSError: If the last generation could not be read
+        """
+        self._checked = time.time()
+        failed = None
+        while True:
+            current = current_generation(self.directory)
+            if current is None or current[0] <= self._snapshot.version:
+                return False
+            try:
+                ema = Ema.load(current[1])
+            except (IOError, OSError):
+                if current == failed:
+                    raise
+                # It may have been removed by newer generations
+                LOG.debug("Generation {:d} is gone".format(current[0]))
+                failed = current
+                continue
+            self._snapshot = Snapshot(current[0], ema)
+            LOG.debug("Mapped generation {:d}".format(current[0]))
+            return True
+
+
+    def snapshot(self):
+        """
+        It returns the last generation, after looking for a newer one if
+        it is time to
+
+        @returns: The number of the generation (0 if there is none yet)
+                  and its model
+        @rtype  : Snapshot
+        """
+        if time.time() - self._checked >= self.interval:
+            self.refresh()
+        return self._snapshot
+
+
+    def get_version(self):
+        """It returns the number of the generation mapped"""
+        return self._snapshot.version
+    version = property(get_version)
+
+
+    def predict(self, x):
+        """It returns the predicted class for features x (see Ema.predict)"""
+        return self.snapshot().ema.predict(x)
+
+
+    def predict_rank(self, x, k=None):
+        """It returns the k most likely classes (see Ema.predict_rank)"""
+        return self.snapshot().ema.predict_rank(x, k)
+
+
+    def predict_rank_indices(self, f, k=None):
+        """
+        It returns the k most likely classes (see Ema.predict_rank_indices)
+        """
+        return self.snapshot().ema.predict_rank_indices(f, k)
+
+
+    def predict_rank_batch(self, X, k):
+        """
+        It returns the k most likely classes of several feature vectors
+
+        See Ema.predict_rank_batch.
+        """
+        return self.snapshot().ema.predict_rank_batch(X, k)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""
+Snapshot-isolated predictions from a model which keeps learning
+
+A single writer learns into its own model and, every some events, publishes
+a copy of it (read-copy-update). Readers predict from the last published
+copy, which is never modified afterwards, so they take no lock, never wait
+for learning and always see W as a whole as it was when it was published.
+
+Publishing replaces a single reference, which is atomic in Python. Older
+copies are released as soon as no reader holds them any more.
+
+What a copy costs depends on the engine of W: the rows engine shares the
+rows which have not been updated since the previous copy, whereas the csr
+and scaled engines copy their whole storage. Hence, copies are published
+every some events rather than after every one of them.
+"""
+
+import logging
+import threading
+from collections import namedtuple
+
+from pyema.ema import Ema
+
+
+__author__ = "José Antonio Martín Baena"
+__email__ = "jose.antonio.martin.baena@gmail.com"
+
+LOG = logging.getLogger("ema.snapshot")
+
+"""Default number of events between two snapshots"""
+PUBLISH_EVERY = 100
+
+
+"""
+Published copy of a model
+
+ version - The number of events the model had learned when it was published
+     ema - The copy of the model, which must only be used to predict
+"""
+Snapshot = namedtuple("Snapshot", ["version", "ema"])
+
+
+def freeze(ema):
+    """
+    It returns a copy of a model which its own learning does not modify
+
+    @param ema: The model
+    @rtype  : Ema
+    """
+    return ema.snapshot()
+
+
+
+class SnapshotEma(object):
+    """
+    Model learnt by a single writer and read from immutable snapshots
+
+    Learning calls are serialised amongst themselves, predicting calls go
+    to the last snapshot. For instance:
+
+    >>> model = SnapshotEma(Ema(engine="rows"), every=100)
+    >>> model.learn_indices([0, 4], 2)            # in the writer thread
+    >>> model.predict_rank_indices([0, 4], 5)     # in any other thread
+
+    A reader which needs several predictions from the same version of the
+    model takes the snapshot once:
+
+    >>> snapshot = model.snapshot()
+    >>> [snapshot.ema.predict_rank_indices(f, 5) for f in queries]
+    """
+
+    def __init__(self, ema=None, every=PUBLISH_EVERY):
+        """
+        @param ema: The model to learn into (default = a new Ema)
+        @param every: The number of events between snapshots (None = only
+                  when publish is called). Every snapshot costs up to a
+                  copy of W (see Ema.snapshot).
+        """
+        self._ema = ema if ema is not None else Ema()
+        self.every = every
+        self._events = 0
+        self._lock = threading.Lock()
+        self._snapshot = Snapshot(0, freeze(self._ema))
+
+
+    def snapshot(self):
+        """
+        It returns the last published snapshot
+
+        @rtype  : Snapshot
+        """
+        return self._snapshot
+
+
+    def get_version(self):
+        """It returns the number of events learnt by the last snapshot"""
+        return self._snapshot.version
+    version = property(get_version)
+
+
+    def get_events(self):
+        """It returns the number of events learnt by the writer"""
+        return self._events
+    events = property(get_events)
+
+
+    def publish(self):
+        """It publishes a snapshot of the model as it is now"""
+        with self._lock:
+            self._publish()
+
+
+    def _publish(self):
+        self._snapshot = Snapshot(self._events, freeze(self._ema))
+        LOG.debug("Snapshot after {:d} events".format(self._events))
+
+
+    def _learnt(self, n=1):
+        """It counts n events and publishes a snapshot if one is due"""
+        before = self._events
+        self._events += n
+        if self.every and self._events // self.every > before // self.every:
+            self._publish()
+
+
+    def skip(self, n):
+        """
+        It counts n events learnt without learning them, as they would not
+        change the model (e.g., repetitions of an event whose margin is
+        already met)
+        """
+        with self._lock:
+            self._learnt(n)
+
+
+    def learn(self, x, y):
+        """It learns class y for features x (see Ema.learn)"""
+        with self._lock:
+            updated = self._ema.learn(x, y)
+            self._learnt()
+        return updated
+
+
+    def learn_indices(self, f, y):
+        """It learns class y for features f (see Ema.learn_indices)"""
+        with self._lock:
+            updated = self._ema.learn_indices(f, y)
+            self._learnt()
+        return updated
+
+
+    def predict_and_learn_indices(self, f, y, k=None):
+        """
+        It predicts the classes for some features and then it learns from them
+
+        Unlike the other predictions, this one comes from the model of the
+        writer (see Ema.predict_and_learn_indices).
+        """
+        with self._lock:
+            ranking = self._ema.predict_and_learn_indices(f, y, k)
+            self._learnt()
+        return ranking
+
+
+    def predict(self, x):
+        """It returns the predicted class for features x (see Ema.predict)"""
+        return self._snapshot.ema.predict(x)
+
+
+    def predict_rank(self, x, k=None):
+        """It returns the k most likely classes (see Ema.predict_rank)"""
+        return self._snapshot.ema.predict_rank(x, k)
+
+
+    def predict_rank_indices(self, f, k=None):
+        """
+        It returns the k most likely classes (see Ema.predict_rank_indices)
+        """
+        return self._snapshot.ema.predict_rank_indices(f, k)
+
+
+    def predict_rank_batch(self, X, k):
+        """
+        It returns the k most likely classes of several feature vectors
+
+        See Ema.predict_rank_batch.
+        """
+        return self._snapshot.ema.predict_rank_batch(X, k)
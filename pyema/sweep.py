@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""
+Search of the parameters b, d and w of EMA
+
+Datasets are parsed once, before the worker processes are forked, so all of
+them share the parsed arrays (copy-on-write, or the page cache for binary
+containers, which are mapped in memory). Every configuration is then
+evaluated by a worker over all the datasets, each one with its own model.
+
+For instance, to try 27 configurations over two users with 4 processes:
+
+>  ema-sweep -b .1,.15,.2 -d .1,.15,.2 -w .005,.01,.02 -j 4 \\
+       scientist-17.sparse scientist-36.ema
+"""
+
+import argparse
+import itertools
+import logging
+import multiprocessing
+import random
+import sys
+import time
+
+import numpy
+
+from pyema import arrayfile
+from pyema.dataset import Dataset, read_dataset, concatenate, load_binary
+from pyema.ema import process_dataset
+from pyema.metrics import parse_metric
+from pyema.weights import ENGINES
+
+
+__author__ = "José Antonio Martín Baena"
+__email__ = "jose.antonio.martin.baena@gmail.com"
+
+LOG = logging.getLogger("ema.sweep")
+
+"""Parameters of EMA which are searched"""
+PARAMS = ("b", "d", "w")
+
+"""Datasets shared with the worker processes"""
+_datasets = None
+
+
+def grid(bs, ds, ws):
+    """
+    It returns every combination of the given values of b, d and w
+
+    @rtype  : [{str: float}]
+    """
+    return [dict(zip(PARAMS, values))
+            for values in itertools.product(bs, ds, ws)]
+
+
+def sample(n, bs, ds, ws, seed=None):
+    """
+    It draws n configurations uniformly from the ranges of the given values
+
+    @param n: The number of configurations
+    @param bs, ds, ws: Values of b, d and w, whose minimum and maximum are
+                       the bounds of their range
+    @param seed: Seed of the random generator
+    @rtype  : [{str: float}]
+    """
+    rand = random.Random(seed)
+    return [dict((name, rand.uniform(min(values), max(values)))
+                 for (name, values) in zip(PARAMS, (bs, ds, ws)))
+            for _ in xrange(n)]
+
+
+def load_datasets(files, limit=None):
+    """
+    It reads and parses several datasets
+
+    Binary containers are mapped in memory instead of read.
+
+    @param files: Files of encoded datasets or binary containers
+    @param limit: Maximum number of events of every dataset
+    @returns: The Dataset of every file
+    """
+    datasets = []
+    for f in files:
+        if arrayfile.peek(f):
+            (classes, indptr, indices) = load_binary(f.name)[0]
+            end = len(classes) if limit is None else limit
+            datasets.append(Dataset(classes[:end], indptr[:end + 1], indices))
+        else:
+            datasets.append(concatenate(read_dataset(f, 0, limit)))
+    return datasets
+
+
+def evaluate(config, datasets=None, metrics=("r@1", "r@5"), engine="csr"):
+    """
+    It evaluates a configuration of EMA over several datasets
+
+    Every metric is averaged over the datasets, i.e., every dataset weights
+    the same whatever its number of events.
+
+    @param config: Arguments of Ema (e.g. b, d and w)
+    @param datasets: The datasets (default = the shared ones)
+    @param metrics: Specs of the metrics (see pyema.metrics)
+    @param engine: How Ema stores its matrix of weights
+    @returns: The mean value of every metric and the wall time spent
+    @rtype  : ([float], float)
+    """
+    if datasets is None:
+        datasets = _datasets
+    start = time.time()
+    values = []
+    for dataset in datasets:
+        ms = [parse_metric(m) for m in metrics]
+        process_dataset(dataset, engine=engine, keep=False, metrics=ms,
+                        params=config)
+        values.append([m.value for m in ms])
+    return (numpy.mean(values, 0).tolist(), time.time() - start)
+
+
+def _evaluate_job(job):
+    """It evaluates a (config, metrics, engine) job in a worker process"""
+    (config, metrics, engine) = job
+    return evaluate(config, None, metrics, engine)
+
+
+def sweep(datasets, configs, metrics=("r@1", "r@5"), engine="csr",
+          processes=None):
+    """
+    It evaluates several configurations of EMA
+
+    @param datasets: The datasets (see load_datasets)
+    @param configs: Arguments of Ema (e.g. from grid or sample)
+    @param metrics: Specs of the metrics (see pyema.metrics)
+    @param engine: How Ema stores its matrix of weights
+    @param processes: Number of worker processes (default = CPU count)
+    @returns: A generator of (config, metric values, wall time), in the
+              order of configs
+    """
+    global _datasets
+    if processes == 1:
+        for config in configs:
+            yield (config,) + evaluate(config, datasets, metrics, engine)
+        return
+    jobs = [(config, tuple(metrics), engine) for config in configs]
+    # Workers are forked right after, so they share the datasets
+    _datasets = datasets
+    pool = multiprocessing.Pool(processes)
+    try:
+        for (config, result) in zip(configs,
+                                    pool.imap(_evaluate_job, jobs)):
+            yield (config,) + result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        _datasets = None
+
+
+def _floats(text):
+    """It parses a comma-separated list of floats"""
+    try:
+        return [float(v) for v in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Not a list of numbers: {!r}"
+                                         .format(text))
+
+
+def main():
+    """\
+It evaluates EMA over several datasets for every given value of b, d and w
+
+Execute as a script with '-h' for details
+   """
+    parser = argparse.ArgumentParser(description="""\
+            It evaluates EMA over the given datasets for every combination
+            of the given values of b, d and w (or for random values within
+            their range), printing the mean metrics and the wall time of
+            every configuration""")
+    parser.add_argument('files',
+            help="Encoded files (or binary containers) to process",
+            type=argparse.FileType('rb'),
+            metavar="F",
+            nargs="+")
+    parser.add_argument('-b',
+            help="Comma-separated values of the boost b",
+            type=_floats,
+            default=[.15])
+    parser.add_argument('-d',
+            help="Comma-separated values of the margin d",
+            type=_floats,
+            default=[.15])
+    parser.add_argument('-w',
+            help="Comma-separated values of the zeroing threshold w",
+            type=_floats,
+            default=[.01])
+    parser.add_argument('-n',
+            help="Number of random configurations instead of the grid",
+            type=int)
+    parser.add_argument('-s',
+            help="Seed of the random configurations",
+            type=int)
+    parser.add_argument('-m',
+            help="Metric to print (default = r@1 and r@5)",
+            type=parse_metric,
+            action='append')
+    parser.add_argument('-l',
+            help="Maximum number of events of every file",
+            type=int)
+    parser.add_argument('-e',
+            help="Engine used to store the matrix of weights",
+            choices=sorted(ENGINES),
+            default="csr")
+    parser.add_argument('-j',
+            help="Number of worker processes (default = CPU count)",
+            type=int)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.n:
+        configs = sample(args.n, args.b, args.d, args.w, args.s)
+    else:
+        configs = grid(args.b, args.d, args.w)
+    metrics = [m.name for m in args.m] if args.m else ["r@1", "r@5"]
+
+    current_time = time.time()
+    datasets = load_datasets(args.files, args.l)
+    LOG.info("Parsing time: {:f} s.".format(time.time() - current_time))
+
+    sys.stdout.write("\t".join(list(PARAMS) + metrics + ["time"]) + "\n")
+    for (config, values, spent) in sweep(datasets, configs, metrics,
+                                         args.e, args.j):
+        sys.stdout.write("\t".join(
+                ["{:g}".format(config[p]) for p in PARAMS] +
+                ["{:g}".format(v) for v in values] +
+                ["{:.3f}".format(spent)]) + "\n")
+        sys.stdout.flush()
+    LOG.info("Time spent: {:f} s.".format(time.time() - current_time))
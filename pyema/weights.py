@@ -0,0 +1,969 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""
+Storage of the matrix of weights W used by EMA
+
+The weights are kept together with the sum of every row (i.e., of every
+feature) so that the margin of an event can be computed by only looking at
+its active features, instead of scoring every class.
+"""
+
+import logging
+from itertools import izip
+
+from scipy.sparse import coo_matrix, csr_matrix, isspmatrix_csr, vstack
+import numpy
+
+
+__author__ = "José Antonio Martín Baena"
+__email__ = "jose.antonio.martin.baena@gmail.com"
+
+LOG = logging.getLogger("ema.weights")
+
+"""Scale factors below this one are folded back into the weights of a row"""
+SCALE_MIN = 1e-100
+
+"""Minimum number of slots reserved for every row of W"""
+MIN_CAPACITY = 4
+
+"""Maximum number of scores summed up at once when scoring several vectors"""
+BATCH_SCORES = 1 << 20
+
+"""Room left at the end of the storage of W for the rows which are moved
+there, as a fraction of the slots laid out"""
+TAIL_ROOM = .5
+
+
+class CsrWeights(object):
+    """
+    Matrix of weights W stored as a scipy.sparse CSR matrix
+
+    Rows are features and columns are classes (both 0-based). Next to W,
+    it keeps the sum of each of its rows up to date through every decay,
+    boost and drop of weights.
+
+    Every row has some slack capacity, i.e., stored zeros, so new weights
+    can be inserted in place. Hence, indices are neither sorted nor unique
+    amongst the stored zeros. A row which runs out of free slots is moved
+    to the end of the storage with twice its slots, leaving its old slots
+    unused, so W is only laid out again when it is compacted or when it
+    gets more rows. As the storage is not a CSR matrix then, W is only
+    turned into one when the whole matrix is read.
+
+    The (logical) shape of W is tracked apart from its capacity, i.e., the
+    number of rows and columns it has room for. The capacity doubles when
+    W outgrows it, so resizing W costs amortized O(1).
+    """
+
+
+    def __init__(self, size=None, W=None):
+        """
+        @param size: Initial size of the matrix W
+        @type  size: (int, int)
+        @param    W: An initial matrix of weights, superseedes size
+        """
+        if W is None:
+            W = csr_matrix(size if size is not None else (1, 1))
+        elif not isspmatrix_csr(W):
+            W = csr_matrix(W)
+        W = W.astype(float)
+        self._shape = W.shape
+        self._capacity = W.shape
+        self._data = W.data
+        self._indices = W.indices.astype(numpy.intc)
+        self._set_layout(W.indptr.astype(numpy.intc))
+        self._rowsums = numpy.asarray(W.sum(1), dtype=float).ravel()
+        self._relayout()
+
+
+    def get_matrix(self):
+        """
+        It returns the current matrix of weights as a CSR matrix
+
+        The matrix is a copy of W without stored zeros, which later updates
+        of W do not modify.
+        """
+        (data, indices, indptr) = self._pack(self._shape[0])
+        return csr_matrix((data, indices, indptr), self._shape)
+    matrix = property(get_matrix)
+
+
+    def get_shape(self):
+        """It returns the shape (features, classes) of W"""
+        return self._shape
+    shape = property(get_shape)
+
+
+    def get_capacity(self):
+        """It returns how many (features, classes) W has room for"""
+        return self._capacity
+    capacity = property(get_capacity)
+
+
+    def get_rowsums(self):
+        """It returns the array with the sum of every row of W"""
+        return self._rowsums[:self._shape[0]]
+    rowsums = property(get_rowsums)
+
+
+    def _set_layout(self, indptr):
+        """It takes the slots of every row from the indptr of a CSR matrix"""
+        # Rows may be moved, so where they start and end is kept apart
+        self._starts = indptr[:-1].copy()
+        self._ends = indptr[1:].copy()
+        self._top = int(indptr[-1])
+
+
+    def _grow_rows(self, nrow):
+        """It makes room for nrow rows in the arrays kept per row"""
+        sums = numpy.zeros(nrow)
+        sums[:len(self._rowsums)] = self._rowsums
+        self._rowsums = sums
+
+
+    def _relayout(self, nrow=None):
+        """
+        It lays W out again leaving slack capacity in every row
+
+        Each row gets twice the slots it needs (and at least MIN_CAPACITY),
+        and the storage gets some room at its end for the rows which run out
+        of slots (see _move_row).
+
+        @param nrow: The new number of rows W has room for
+                     (default = the current one)
+        """
+        old_nrow = len(self._starts)
+        if nrow is None:
+            nrow = max(old_nrow, self._capacity[0])
+        (rows, live) = self._live(old_nrow)
+        counts = numpy.bincount(rows, minlength=nrow)
+        capacity = numpy.maximum(2 * counts, MIN_CAPACITY)
+
+        indptr = numpy.zeros(nrow + 1, dtype=numpy.intc)
+        numpy.cumsum(capacity, out=indptr[1:])
+        size = indptr[-1] + int(indptr[-1] * TAIL_ROOM)
+        new_data = numpy.zeros(size)
+        new_indices = numpy.zeros(size, dtype=numpy.intc)
+        # Rank of every live weight within its row
+        first = numpy.cumsum(counts) - counts
+        pos = indptr[rows] + numpy.arange(len(live)) - first[rows]
+        new_data[pos] = self._data[live]
+        new_indices[pos] = self._indices[live]
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug("Laying W out again (nnz:{};\tcapacity:{})".format(
+                    len(live), indptr[-1]))
+        self._data = new_data
+        self._indices = new_indices
+        self._set_layout(indptr)
+        if nrow > old_nrow:
+            self._grow_rows(nrow)
+        self._capacity = (nrow, self._capacity[1])
+
+
+    def _move_row(self, j):
+        """
+        It moves row j to the end of the storage, with twice its slots
+
+        Its old slots are left unused until W is laid out again, and the
+        storage doubles when it has no room left at its end.
+
+        @returns: Where row j starts now
+        """
+        start, end = self._starts[j], self._ends[j]
+        length = end - start
+        top = self._top
+        new_end = top + max(2 * length, MIN_CAPACITY)
+        if new_end > len(self._data):
+            size = max(new_end, 2 * len(self._data))
+            data = numpy.zeros(size)
+            data[:top] = self._data[:top]
+            indices = numpy.zeros(size, dtype=numpy.intc)
+            indices[:top] = self._indices[:top]
+            self._data = data
+            self._indices = indices
+        self._data[top:top + length] = self._data[start:end]
+        self._indices[top:top + length] = self._indices[start:end]
+        self._starts[j] = top
+        self._ends[j] = new_end
+        self._top = new_end
+        return top
+
+
+    def snapshot(self):
+        """
+        It returns a copy of W which later updates of W do not modify
+
+        Since W is updated in place, it costs copying all its weights (see
+        get_state).
+        """
+        (meta, arrays) = self.get_state()
+        return self.from_state(meta, dict(arrays))
+
+
+    def reserve(self, nrow, ncol):
+        """It makes room in W for at least nrow rows and ncol columns"""
+        if nrow > self._capacity[0]:
+            self._relayout(nrow)
+        if ncol > self._capacity[1]:
+            self._capacity = (self._capacity[0], ncol)
+
+
+    def resize(self, nrow, ncol):
+        """It increases the shape of W to (nrow, ncol)"""
+        rows, cols = self._capacity
+        self.reserve(max(nrow, 2 * rows) if nrow > rows else rows,
+                     max(ncol, 2 * cols) if ncol > cols else cols)
+        self._shape = (nrow, ncol)
+
+
+    def scores(self, f, v):
+        """
+        It returns the scores of all the classes with some weight
+
+        @param f: The indexes of the active features
+        @param v: The values of the active features
+        @returns: The classes and their non-zero scores sum(v[i] * W[f[i], :])
+        @rtype  : (numpy.array, numpy.array)
+        """
+        # The slots of the rows are summed up in the same order than in x * W
+        pos, lengths = self._slots(f)
+        s = numpy.bincount(self._indices[pos],
+                           self._data[pos] * numpy.repeat(v, lengths),
+                           self._shape[1])
+        classes = numpy.flatnonzero(s)
+        return (classes, s[classes])
+
+
+    def scores_batch(self, X):
+        """
+        It returns the scores of all the classes for several feature vectors
+
+        @param X: The feature vectors, one per row
+        @type  X: A CSR matrix with shape (N, M), where W.shape = (M, _)
+        @returns: X * W
+        @rtype  : A CSR matrix with shape (N, W.shape[1])
+        """
+        # The slots of the rows of every vector are gathered and summed up
+        # in the same order than in scores, without building a matrix of W.
+        # Vectors go in blocks whose scores are summed up densely.
+        (n, ncol) = (X.shape[0], self._shape[1])
+        step = max(BATCH_SCORES // ncol, 1)
+        blocks = []
+        for i in xrange(0, n, step):
+            indptr = X.indptr[i:i + step + 1]
+            m = len(indptr) - 1
+            pos, lengths = self._slots(X.indices[indptr[0]:indptr[-1]])
+            vectors = numpy.repeat(numpy.arange(m), numpy.diff(indptr))
+            keys = numpy.repeat(vectors, lengths) * ncol + self._indices[pos]
+            values = self._data[pos] * numpy.repeat(
+                    X.data[indptr[0]:indptr[-1]], lengths)
+            live = values != 0
+            (keys, values) = (keys[live], values[live])
+            S = numpy.bincount(keys, values, m * ncol)
+            # Only the scores some slot was summed into are looked at
+            keys = numpy.unique(keys)
+            rows = numpy.zeros(m + 1, dtype=numpy.intc)
+            numpy.cumsum(numpy.bincount(keys // ncol, minlength=m),
+                         out=rows[1:])
+            blocks.append(csr_matrix((S[keys], keys % ncol, rows), (m, ncol)))
+        if not blocks:
+            return csr_matrix((n, ncol))
+        return blocks[0] if len(blocks) == 1 else vstack(blocks, format="csr")
+
+
+    def lookup(self, f, v, c):
+        """
+        It returns the score of a single class
+
+        @param f: The indexes of the active features
+        @param v: The values of the active features
+        @param c: The index of the class
+        @returns: sum(v[i] * W[f[i], c])
+        """
+        starts = self._starts
+        ends = self._ends
+        indices = self._indices
+        data = self._data
+        s = 0.
+        for i in xrange(len(f)):
+            j = f[i]
+            start, end = starts[j], ends[j]
+            hit = data[start:end][indices[start:end] == c]
+            if len(hit):
+                s += v[i] * hit[0]
+        return s
+
+
+    def total(self, f, v):
+        """
+        It returns the sum of the scores of all the classes
+
+        @param f: The indexes of the active features
+        @param v: The values of the active features
+        @returns: sum(v[i] * sum(W[f[i], :]))
+        """
+        return numpy.dot(self._rowsums[f], v)
+
+
+    def _slots(self, f):
+        """
+        It returns the positions in the storage of all the slots of rows f
+
+        @returns: The positions and the number of slots of every row
+        @rtype  : (numpy.array, numpy.array)
+        """
+        starts = self._starts[f]
+        lengths = self._ends[f] - starts
+        ends = numpy.cumsum(lengths)
+        pos = numpy.arange(ends[-1] if len(ends) else 0)
+        pos += numpy.repeat(starts - ends + lengths, lengths)
+        return (pos, lengths)
+
+
+    def decay(self, f, factors):
+        """It multiplies every row f[i] of W by factors[i]"""
+        f = numpy.asarray(f)
+        if len(numpy.unique(f)) == len(f):
+            pos, lengths = self._slots(f)
+            self._data[pos] *= numpy.repeat(factors, lengths)
+        else:
+            # Repeated rows must be decayed once per occurrence
+            for (j, factor) in izip(f, factors):
+                self._data[self._starts[j]:self._ends[j]] *= factor
+        numpy.multiply.at(self._rowsums, f, factors)
+
+
+    def _add(self, f, v, c):
+        """It adds v[i] to W[f[i], c] in place (only W, not its row sums)"""
+        starts = self._starts
+        ends = self._ends
+        for i in xrange(len(f)):
+            if v[i] == 0:
+                continue
+            j = f[i]
+            start, end = starts[j], ends[j]
+            # Moving a row may replace the storage
+            row = self._data[start:end]
+            hit = numpy.flatnonzero(self._indices[start:end] == c)
+            if len(hit):
+                live = hit[row[hit] != 0]
+                k = live[0] if len(live) else hit[0]
+            else:
+                free = numpy.flatnonzero(row == 0)
+                if len(free):
+                    k = free[0]
+                else:
+                    # The row is full, so only this row gets more slots
+                    k = end - start
+                    start = self._move_row(j)
+                    row = self._data[start:ends[j]]
+                self._indices[start + k] = c
+            row[k] += v[i]
+
+
+    def boost(self, f, v, c):
+        """It adds v[i] to the weight W[f[i], c] of every active feature"""
+        self._add(f, v, c)
+        numpy.add.at(self._rowsums, f, v)
+
+
+    def prune(self, f, w):
+        """
+        It drops every weight below w from the rows f of W
+
+        Dropped weights are just set to zero. They are removed from the
+        matrix by compact(), which should be called every now and then.
+
+        @param f: The indexes of the rows to look at
+        @param w: The threshold for zeroing weights
+        @returns: Whether some weight has been dropped
+        """
+        f = numpy.unique(f)
+        pos, lengths = self._slots(f)
+        values = self._data[pos]
+        sel = (values < w) & (values != 0)
+        if not sel.any():
+            return False
+        rows = numpy.repeat(numpy.arange(len(f)), lengths)[sel]
+        self._rowsums[f] -= numpy.bincount(rows, values[sel], len(f))
+        self._data[pos[sel]] = 0.
+        return True
+
+
+    def compact(self):
+        """
+        It reclaims the slots of all the weights previously dropped and the
+        ones left behind by the rows moved
+        """
+        self._relayout()
+
+
+    def _pack(self, nrow):
+        """
+        It returns the weights of the first nrow rows laid out tightly
+
+        @returns: The data, indices and indptr of a CSR matrix without
+                  stored zeros
+        @rtype  : (numpy.array, numpy.array, numpy.array)
+        """
+        (rows, pos) = self._live(nrow)
+        indptr = numpy.zeros(nrow + 1, dtype=numpy.intc)
+        numpy.cumsum(numpy.bincount(rows, minlength=nrow), out=indptr[1:])
+        return (self._data[pos], self._indices[pos], indptr)
+
+
+    def _live(self, nrow):
+        """
+        It returns where the weights of the first nrow rows are stored
+
+        @returns: The row and the position in the storage of every weight,
+                  row after row
+        @rtype  : (numpy.array, numpy.array)
+        """
+        pos, lengths = self._slots(numpy.arange(nrow))
+        rows = numpy.repeat(numpy.arange(nrow), lengths)
+        live = self._data[pos] != 0
+        return (rows[live], pos[live])
+
+
+    def get_state(self):
+        """
+        It returns what must be saved to restore W (see from_state)
+
+        A copy of W is saved without any slack, i.e., with the capacity it
+        needs, so that it can be used again straight from a memory-mapped
+        file. It gets room for new weights when it is updated.
+
+        @returns: The sizes of W and its named arrays
+        @rtype  : (dict, [(str, numpy.array)])
+        """
+        nrow = self._shape[0]
+        (data, indices, indptr) = self._pack(nrow)
+        meta = {"shape": list(self._shape), "capacity": list(self._shape)}
+        return (meta, [("data", data), ("indices", indices),
+                       ("indptr", indptr),
+                       ("rowsums", self._rowsums[:nrow].copy())])
+
+
+    @classmethod
+    def from_state(cls, meta, arrays):
+        """
+        It restores a matrix of weights saved with get_state
+
+        The given arrays are used without copying them, so they may be
+        (copy-on-write) memory maps.
+
+        @param meta: The sizes of W
+        @param arrays: The named arrays of W
+        @type  arrays: {str: numpy.array}
+        """
+        self = cls.__new__(cls)
+        self._set_state(meta, dict((name, numpy.asarray(a))
+                                   for (name, a) in arrays.iteritems()))
+        return self
+
+
+    def _set_state(self, meta, arrays):
+        """It takes the sizes and the arrays of a saved W"""
+        self._shape = tuple(meta["shape"])
+        self._capacity = tuple(meta["capacity"])
+        self._data = arrays["data"]
+        self._indices = arrays["indices"]
+        self._set_layout(arrays["indptr"])
+        self._rowsums = arrays["rowsums"]
+
+
+
+class ScaledCsrWeights(CsrWeights):
+    """
+    Matrix of weights W stored as a CSR matrix with a scale factor per row
+
+    The actual weights of row j are scale[j] * W[j, :]. Decaying a row only
+    multiplies its scale factor and boosting stores the boost divided by it,
+    so neither of them walks through the row. The scale factors are folded
+    back into W when they underflow or when the whole matrix is read.
+
+    Rows are only looked at for dropping small weights when a lower bound
+    of their smallest weight says that there may be something to drop.
+    """
+
+
+    def __init__(self, size=None, W=None):
+        CsrWeights.__init__(self, size=size, W=W)
+        nrow = len(self._rowsums)
+        self._scale = numpy.ones(nrow)
+        self._rowmin = numpy.empty(nrow)
+        for j in xrange(nrow):
+            self._reset_rowmin(j)
+
+
+    def get_matrix(self):
+        """It returns the current matrix of weights as a CSR matrix"""
+        pos, lengths = self._slots(numpy.arange(len(self._scale)))
+        self._data[pos] *= numpy.repeat(self._scale, lengths)
+        self._rowmin *= self._scale
+        self._scale[:] = 1.
+        return CsrWeights.get_matrix(self)
+    matrix = property(get_matrix)
+
+
+    def _grow_rows(self, nrow):
+        """It makes room for nrow rows in the arrays kept per row"""
+        old = len(self._scale)
+        CsrWeights._grow_rows(self, nrow)
+        self._scale = numpy.concatenate((self._scale, numpy.ones(nrow - old)))
+        self._rowmin = numpy.concatenate(
+                (self._rowmin, numpy.repeat(numpy.inf, nrow - old)))
+
+
+    def get_state(self):
+        """It returns what must be saved to restore W, scale factors too"""
+        (meta, arrays) = CsrWeights.get_state(self)
+        nrow = self._shape[0]
+        return (meta, arrays + [("scale", self._scale[:nrow].copy()),
+                                ("rowmin", self._rowmin[:nrow].copy())])
+
+
+    def _set_state(self, meta, arrays):
+        """It takes the sizes and the arrays of a saved W"""
+        CsrWeights._set_state(self, meta, arrays)
+        self._scale = arrays["scale"]
+        self._rowmin = arrays["rowmin"]
+
+
+    def _reset_rowmin(self, j):
+        row = self._data[self._starts[j]:self._ends[j]]
+        row = row[row != 0]
+        self._rowmin[j] = row.min() if len(row) else numpy.inf
+
+
+    def _normalise(self, j):
+        """It folds the scale factor of row j into its weights"""
+        self._data[self._starts[j]:self._ends[j]] *= self._scale[j]
+        self._rowmin[j] *= self._scale[j]
+        self._scale[j] = 1.
+
+
+    def scores(self, f, v):
+        """
+        It returns the scores of all the classes with some weight
+
+        @param f: The indexes of the active features
+        @param v: The values of the active features
+        @returns: The classes and their non-zero scores sum(v[i] * W[f[i], :])
+        @rtype  : (numpy.array, numpy.array)
+        """
+        return CsrWeights.scores(self, f, v * self._scale[f])
+
+
+    def scores_batch(self, X):
+        """
+        It returns the scores of all the classes for several feature vectors
+
+        @param X: The feature vectors, one per row
+        @type  X: A CSR matrix with shape (N, M), where W.shape = (M, _)
+        @returns: X * W
+        @rtype  : A CSR matrix with shape (N, W.shape[1])
+        """
+        X = X.copy()
+        X.data *= self._scale[X.indices]
+        return CsrWeights.scores_batch(self, X)
+
+
+    def lookup(self, f, v, c):
+        """
+        It returns the score of a single class
+
+        @param f: The indexes of the active features
+        @param v: The values of the active features
+        @param c: The index of the class
+        @returns: sum(v[i] * W[f[i], c])
+        """
+        return CsrWeights.lookup(self, f, v * self._scale[f], c)
+
+
+    def decay(self, f, factors):
+        """It multiplies every row f[i] of W by factors[i]"""
+        scale = self._scale
+        sums = self._rowsums
+        for i in xrange(len(f)):
+            j = f[i]
+            scale[j] *= factors[i]
+            sums[j] *= factors[i]
+            if scale[j] < SCALE_MIN:
+                self._normalise(j)
+
+
+    def boost(self, f, v, c):
+        """It adds v[i] to the weight W[f[i], c] of every active feature"""
+        u = v / self._scale[f]
+        self._add(f, u, c)
+        numpy.add.at(self._rowsums, f, v)
+        numpy.minimum.at(self._rowmin, f, u)
+
+
+    def prune(self, f, w):
+        """
+        It drops every weight below w from the rows f of W
+
+        @param f: The indexes of the rows to look at
+        @param w: The threshold for zeroing weights
+        @returns: Whether some weight has been dropped
+        """
+        starts = self._starts
+        ends = self._ends
+        data = self._data
+        scale = self._scale
+        sums = self._rowsums
+        dropped = False
+        for j in numpy.unique(f):
+            if self._rowmin[j] * scale[j] >= w:
+                continue
+            row = data[starts[j]:ends[j]]
+            sel = (row * scale[j] < w) & (row != 0)
+            if numpy.any(sel):
+                sums[j] -= row[sel].sum() * scale[j]
+                row[sel] = 0.
+                dropped = True
+            self._reset_rowmin(j)
+        return dropped
+
+
+
+
+class RowWeights(object):
+    """
+    Matrix of weights W stored as a mapping from features to their rows
+
+    Every row is a {class: weight} dictionary. Since weights decay every
+    time their feature is active and they are dropped below a threshold,
+    rows stay short and pure Python dictionaries beat both scipy.sparse and
+    numpy arrays on them. It computes exactly the same weights as
+    CsrWeights does.
+    """
+
+
+    def __init__(self, size=None, W=None):
+        """
+        @param size: Initial size of the matrix W
+        @type  size: (int, int)
+        @param    W: An initial matrix of weights, superseedes size
+        """
+        self._rows = {}
+        if W is None:
+            self._shape = tuple(size) if size is not None else (1, 1)
+        else:
+            W = csr_matrix(W).astype(float)
+            W.eliminate_zeros()
+            self._shape = W.shape
+            for j in xrange(W.shape[0]):
+                start, end = W.indptr[j], W.indptr[j + 1]
+                if end > start:
+                    self._rows[j] = dict(zip(W.indices[start:end].tolist(),
+                                             W.data[start:end].tolist()))
+        self._capacity = self._shape
+        self._rowsums = numpy.zeros(self._shape[0])
+        for (j, row) in self._rows.iteritems():
+            self._rowsums[j] = sum(row.itervalues())
+        self._owned = None
+
+
+    def get_matrix(self):
+        """It returns the current matrix of weights as a CSR matrix"""
+        rows = []
+        cols = []
+        data = []
+        for (j, row) in self._rows.iteritems():
+            rows.extend([j] * len(row))
+            cols.extend(row.iterkeys())
+            data.extend(row.itervalues())
+        return coo_matrix((data, (rows, cols)), self._shape).tocsr()
+    matrix = property(get_matrix)
+
+
+    def get_shape(self):
+        """It returns the shape (features, classes) of W"""
+        return self._shape
+    shape = property(get_shape)
+
+
+    def get_capacity(self):
+        """It returns how many (features, classes) W has room for"""
+        return self._capacity
+    capacity = property(get_capacity)
+
+
+    def get_rowsums(self):
+        """It returns the array with the sum of every row of W"""
+        return self._rowsums[:self._shape[0]]
+    rowsums = property(get_rowsums)
+
+
+    def get_state(self):
+        """
+        It returns what must be saved to restore W (see from_state)
+
+        Rows are saved CSR-style, keeping the order of their dictionaries,
+        into new arrays.
+
+        @returns: The sizes of W and its named arrays
+        @rtype  : (dict, [(str, numpy.array)])
+        """
+        rows = self._rows
+        lengths = numpy.zeros(self._shape[0], dtype=numpy.intc)
+        for (j, row) in rows.iteritems():
+            lengths[j] = len(row)
+        indptr = numpy.zeros(self._shape[0] + 1, dtype=numpy.intc)
+        numpy.cumsum(lengths, out=indptr[1:])
+        indices = numpy.zeros(indptr[-1], dtype=numpy.intc)
+        data = numpy.zeros(indptr[-1])
+        for (j, row) in rows.iteritems():
+            indices[indptr[j]:indptr[j + 1]] = row.keys()
+            data[indptr[j]:indptr[j + 1]] = row.values()
+        meta = {"shape": list(self._shape), "capacity": list(self._capacity)}
+        return (meta, [("data", data), ("indices", indices),
+                       ("indptr", indptr), ("rowsums", self._rowsums.copy())])
+
+
+    @classmethod
+    def from_state(cls, meta, arrays):
+        """
+        It restores a matrix of weights saved with get_state
+
+        Rows are rebuilt from the arrays, only the row sums are used as
+        they are (e.g., memory-mapped).
+
+        @param meta: The sizes of W
+        @param arrays: The named arrays of W
+        @type  arrays: {str: numpy.array}
+        """
+        self = cls.__new__(cls)
+        self._shape = tuple(meta["shape"])
+        self._capacity = tuple(meta["capacity"])
+        self._rowsums = numpy.asarray(arrays["rowsums"])
+        self._owned = None
+        indptr = arrays["indptr"].tolist()
+        indices = arrays["indices"].tolist()
+        data = arrays["data"].tolist()
+        self._rows = {}
+        for j in xrange(len(indptr) - 1):
+            if indptr[j + 1] > indptr[j]:
+                self._rows[j] = dict(zip(indices[indptr[j]:indptr[j + 1]],
+                                         data[indptr[j]:indptr[j + 1]]))
+        return self
+
+
+    def snapshot(self):
+        """
+        It returns a copy of W which later updates of W do not modify
+
+        Rows are shared between W and the copy until one of them updates
+        them (copy-on-write), so it only costs copying the references to
+        the rows and the row sums.
+        """
+        copy = self.__class__.__new__(self.__class__)
+        copy._shape = self._shape
+        copy._capacity = self._capacity
+        copy._rowsums = self._rowsums.copy()
+        copy._rows = dict(self._rows)
+        copy._owned = set()
+        self._owned = set()
+        return copy
+
+
+    def _own(self, j):
+        """It returns row j, copying it first if it is shared (or None)"""
+        row = self._rows.get(j)
+        if row is not None and j not in self._owned:
+            row = self._rows[j] = dict(row)
+            self._owned.add(j)
+        return row
+
+
+    def reserve(self, nrow, ncol):
+        """It makes room in W for at least nrow rows and ncol columns"""
+        if nrow > self._capacity[0]:
+            sums = numpy.zeros(nrow)
+            sums[:len(self._rowsums)] = self._rowsums
+            self._rowsums = sums
+        self._capacity = (max(nrow, self._capacity[0]),
+                          max(ncol, self._capacity[1]))
+
+
+    def resize(self, nrow, ncol):
+        """It increases the shape of W to (nrow, ncol)"""
+        rows, cols = self._capacity
+        self.reserve(max(nrow, 2 * rows) if nrow > rows else rows,
+                     max(ncol, 2 * cols) if ncol > cols else cols)
+        self._shape = (nrow, ncol)
+
+
+    def scores(self, f, v):
+        """
+        It returns the scores of all the classes with some weight
+
+        @param f: The indexes of the active features
+        @param v: The values of the active features
+        @returns: The classes and their non-zero scores sum(v[i] * W[f[i], :])
+        @rtype  : (numpy.array, numpy.array)
+        """
+        rows = self._rows
+        s = {}
+        get = s.get
+        # The scores are accumulated in the same order than in x * W
+        for (j, x) in izip(numpy.asarray(f).tolist(),
+                           numpy.asarray(v).tolist()):
+            row = rows.get(j)
+            if row:
+                for (c, w) in row.iteritems():
+                    s[c] = get(c, 0.) + x * w
+        classes = numpy.fromiter(s.iterkeys(), numpy.intc, len(s))
+        scores = numpy.fromiter(s.itervalues(), float, len(s))
+        nz = scores != 0
+        return (classes[nz], scores[nz])
+
+
+    def scores_batch(self, X):
+        """
+        It returns the scores of all the classes for several feature vectors
+
+        @param X: The feature vectors, one per row
+        @type  X: A CSR matrix with shape (N, M), where W.shape = (M, _)
+        @returns: X * W
+        @rtype  : A CSR matrix with shape (N, W.shape[1])
+        """
+        indptr = [0]
+        classes = []
+        scores = []
+        for i in xrange(X.shape[0]):
+            start, end = X.indptr[i], X.indptr[i + 1]
+            c, s = self.scores(X.indices[start:end], X.data[start:end])
+            classes.append(c)
+            scores.append(s)
+            indptr.append(indptr[-1] + len(c))
+        return csr_matrix((numpy.concatenate(scores or [[]]),
+                           numpy.concatenate(classes or [[]]), indptr),
+                          (X.shape[0], self._shape[1]))
+
+
+    def lookup(self, f, v, c):
+        """
+        It returns the score of a single class
+
+        @param f: The indexes of the active features
+        @param v: The values of the active features
+        @param c: The index of the class
+        @returns: sum(v[i] * W[f[i], c])
+        """
+        rows = self._rows
+        s = 0.
+        for (j, x) in izip(numpy.asarray(f).tolist(),
+                           numpy.asarray(v).tolist()):
+            row = rows.get(j)
+            if row:
+                w = row.get(c)
+                if w is not None:
+                    s += x * w
+        return s
+
+
+    def total(self, f, v):
+        """
+        It returns the sum of the scores of all the classes
+
+        @param f: The indexes of the active features
+        @param v: The values of the active features
+        @returns: sum(v[i] * sum(W[f[i], :]))
+        """
+        return numpy.dot(self._rowsums[f], v)
+
+
+    def decay(self, f, factors):
+        """It multiplies every row f[i] of W by factors[i]"""
+        get = self._rows.get if self._owned is None else self._own
+        sums = self._rowsums
+        for (j, factor) in izip(numpy.asarray(f).tolist(),
+                                numpy.asarray(factors).tolist()):
+            row = get(j)
+            if row:
+                for (c, w) in row.items():
+                    row[c] = w * factor
+            sums[j] *= factor
+
+
+    def boost(self, f, v, c):
+        """It adds v[i] to the weight W[f[i], c] of every active feature"""
+        rows = self._rows
+        get = rows.get if self._owned is None else self._own
+        sums = self._rowsums
+        for (j, x) in izip(numpy.asarray(f).tolist(),
+                           numpy.asarray(v).tolist()):
+            if x == 0:
+                continue
+            row = get(j)
+            if row is None:
+                row = rows[j] = {}
+                if self._owned is not None:
+                    # No snapshot shares it
+                    self._owned.add(j)
+            row[c] = row.get(c, 0.) + x
+            sums[j] += x
+
+
+    def prune(self, f, w):
+        """
+        It drops every weight below w from the rows f of W
+
+        @param f: The indexes of the rows to look at
+        @param w: The threshold for zeroing weights
+        @returns: Whether some weight has been dropped
+        """
+        rows = self._rows
+        sums = self._rowsums
+        dropped = False
+        for j in set(numpy.asarray(f).tolist()):
+            row = rows.get(j)
+            if not row:
+                continue
+            small = [c for (c, x) in row.iteritems() if x < w]
+            if small:
+                if self._owned is not None:
+                    row = self._own(j)
+                sums[j] -= sum(row.pop(c) for c in small)
+                if not row:
+                    del rows[j]
+                dropped = True
+        return dropped
+
+
+    def compact(self):
+        """Dropped weights are already removed from W"""
+        pass
+
+
+
+"""Available engines for storing W (see Ema's engine argument)"""
+ENGINES = {
+        "csr": CsrWeights,
+        "scaled": ScaledCsrWeights,
+        "rows": RowWeights,
+        }
@@ -59,5 +59,6 @@ setup(name='pyema',
         package_data = {'tests.pyema':['*.sparse']},
         license="GPLv3",
         test_suite="tests.test_all",
-        scripts=["scripts/ema"],
+        scripts=["scripts/ema", "scripts/ema-convert",
+                 "scripts/ema-sweep", "scripts/ema-server"],
         );
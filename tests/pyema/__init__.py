@@ -15,5 +15,5 @@
 # along with pyema.  If not, see <http://www.gnu.org/licenses/>.
 ##
 
-__all__ = ["ematest"]
+__all__ = ["ematest", "weightstest", "metricstest", "datasettest", "arrayfiletest", "sweeptest", "checkpointtest", "servertest", "snapshottest", "deferredtest", "sharedtest"]
 
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""\
+Tests the binary container of arrays
+"""
+
+
+import os;
+import shutil;
+import tempfile;
+import unittest;
+import logging;
+
+import numpy;
+
+from pyema import arrayfile;
+
+log = logging.getLogger('arrayfiletest');
+
+
+class ArrayFileTest(unittest.TestCase):
+
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp();
+        self.name = os.path.join(self.tmp, "arrays.bin");
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp);
+
+
+    def test_save_and_load(self):
+        a = numpy.arange(5, dtype=numpy.int32);
+        b = numpy.array([[.5, 1.], [2., 3.]]);
+        e = numpy.zeros(0);
+        arrayfile.save(self.name, "test", [("a", a), ("b", b), ("e", e)],
+                       {"x": 1});
+        for mmap in (True, False):
+            (kind, meta, arrays) = arrayfile.load(self.name, mmap);
+            self.assertEqual((kind, meta), ("test", {"x": 1}));
+            self.assertEqual(arrays["a"].tolist(), a.tolist());
+            self.assertEqual(arrays["b"].tolist(), b.tolist());
+            self.assertEqual(arrays["e"].shape, (0,));
+        self.assertTrue(isinstance(arrayfile.load(self.name)[2]["a"],
+                                   numpy.memmap));
+        with open(self.name, "rb") as inp:
+            self.assertTrue(arrayfile.peek(inp));
+            self.assertEqual(inp.tell(), 0);
+
+
+    def test_copy_on_write(self):
+        arrayfile.save(self.name, "test", [("a", numpy.arange(3.))]);
+        a = arrayfile.load(self.name, mode="c")[2]["a"];
+        a[0] = 7.;
+        self.assertEqual(arrayfile.load(self.name)[2]["a"].tolist(),
+                         [0., 1., 2.]);
+
+
+    def test_writer(self):
+        w = arrayfile.Writer(self.name, "test", [("a", "<i4"), ("b", "<f8")]);
+        w.append("a", numpy.arange(3));
+        w.append("b", [.5]);
+        w.append("a", numpy.arange(2));
+        w.close({"n": 5});
+        (kind, meta, arrays) = arrayfile.load(self.name);
+        self.assertEqual(meta, {"n": 5});
+        self.assertEqual(arrays["a"].tolist(), [0, 1, 2, 0, 1]);
+        self.assertEqual(arrays["b"].tolist(), [.5]);
+        self.assertEqual(arrays["b"].offset % arrayfile.ALIGN, 0);
+
+
+    def test_not_a_container(self):
+        with open(self.name, "wb") as out:
+            out.write("1 2 3 4\n");
+        self.assertRaises(ValueError, arrayfile.load, self.name);
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig();
+    unittest.main();
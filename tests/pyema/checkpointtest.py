@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""\
+Tests the checkpoints of long runs of EMA
+"""
+
+
+import os;
+import shutil;
+import tempfile;
+import unittest;
+import logging;
+from StringIO import StringIO;
+
+from pyema.ema import Ema, process_dataset, file2dataset, evaluate_file;
+from pyema.metrics import parse_metric;
+from pyema.checkpoint import Checkpoint, Checkpointer, load_checkpoint;
+
+log = logging.getLogger('checkpointtest');
+
+
+def relative_path(relpath):
+    """Return the absolute path correspoding to the given relative one"""
+    prefix = os.path.dirname(__file__)
+    return os.path.join(prefix,relpath)
+
+
+class CheckpointTest(unittest.TestCase):
+
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp();
+        self.path = os.path.join(self.tmp, "run.ckpt");
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            self.dataset = list(file2dataset(inp));
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp);
+
+
+    def test_resume(self):
+        for engine in ("csr", "rows"):
+            summary = StringIO();
+            results = process_dataset(self.dataset, stdout=summary,
+                    engine=engine, metrics=[parse_metric("r@1/w50")]);
+            checkpoint = Checkpointer(self.path, every=100);
+            process_dataset(self.dataset, 250, engine=engine,
+                            metrics=[parse_metric("r@1/w50")],
+                            checkpoint=checkpoint);
+            self.assertFalse(os.path.exists(self.path + ".tmp"));
+            resume = load_checkpoint(self.path);
+            self.assertEqual((resume.start, resume.events), (0, 250));
+            resumed = StringIO();
+            self.assertEqual(process_dataset(self.dataset[250:],
+                    stdout=resumed, metrics=[parse_metric("r@1/w50")],
+                    resume=resume), results[250:]);
+            self.assertEqual(resumed.getvalue(), summary.getvalue());
+
+
+    def test_every(self):
+        checkpoint = Checkpointer(self.path, every=100);
+        process_dataset(self.dataset, 250, checkpoint=checkpoint);
+        checkpoint = Checkpointer(self.path, every=100);
+        self.assertTrue(checkpoint.due(200));
+        self.assertFalse(checkpoint.due(201));
+        checkpoint = Checkpointer(self.path, seconds=.01);
+        self.assertFalse(checkpoint.due(1));
+        checkpoint._last -= 1;
+        self.assertTrue(checkpoint.due(1));
+        self.assertEqual(load_checkpoint(self.path + ".none"), None);
+        Ema().save(self.path);
+        self.assertRaises(ValueError, load_checkpoint, self.path);
+        # R1 and R5 are always there, so it lacks one metric
+        resume = Checkpoint(Ema(), 0, 0, [{"count": 0, "sum": 0.}]);
+        self.assertRaises(ValueError, process_dataset, self.dataset,
+                          resume=resume);
+
+
+    def test_other_engine(self):
+        name = os.path.join(self.tmp, "scientist-17.sparse");
+        shutil.copy(relative_path("scientist-17.sparse"), name);
+        options = {"limit": 250, "start": 0, "shard": None, "index": False,
+                   "engine": "rows", "report": None, "metrics": [],
+                   "checkpoint_every": 100};
+        with file(name, 'rb') as inp:
+            evaluate_file(inp, options, stdout=StringIO());
+        options = dict(options, limit=None, engine="csr", resume=True);
+        with file(name, 'rb') as inp:
+            self.assertRaises(ValueError, evaluate_file, inp, options,
+                              stdout=StringIO());
+        # The state of the model is taken as a copy
+        ema = Ema(engine="rows");
+        ema.learn_indices([0, 1], 1);
+        sums = ema._W.rowsums.tolist();
+        (_, arrays) = ema.get_state();
+        ema.learn_indices([0, 1], 2);
+        self.assertNotEqual(ema._W.rowsums.tolist(), sums);
+        self.assertEqual(dict(arrays)["rowsums"][:2].tolist(), sums);
+
+
+    def test_other_metrics(self):
+        process_dataset(self.dataset, 250, metrics=[parse_metric("mrr")],
+                        checkpoint=Checkpointer(self.path, every=100));
+        resume = load_checkpoint(self.path);
+        # As many metrics as the run had, but not the same ones
+        self.assertRaises(ValueError, process_dataset, self.dataset[250:],
+                          metrics=[parse_metric("r@10")], resume=resume);
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig();
+    unittest.main();
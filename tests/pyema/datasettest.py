@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""\
+Tests the bulk reader of encoded datasets
+"""
+
+
+import os;
+import shutil;
+import tempfile;
+import unittest;
+import logging;
+from StringIO import StringIO;
+
+from pyema.ema import file2dataset, process_dataset;
+from pyema.dataset import parse_block, read_blocks, load, events, split, \
+        save_binary, load_binary, read_dataset, build_index, load_index, \
+        index_name, shards;
+
+log = logging.getLogger('datasettest');
+
+
+def relative_path(relpath):
+    """Return the absolute path correspoding to the given relative one"""
+    prefix = os.path.dirname(__file__)
+    return os.path.join(prefix,relpath)
+
+
+class DatasetTest(unittest.TestCase):
+
+
+    def test_parse_block(self):
+        (classes, indptr, indices) = parse_block(
+                "1\t2\t1 2\n\n3 0\r\n2\t3\t4 1 5");
+        self.assertEqual(classes.tolist(), [1, 3, 2]);
+        self.assertEqual(indptr.tolist(), [0, 2, 2, 5]);
+        self.assertEqual(indices.tolist(), [1, 2, 4, 1, 5]);
+        self.assertEqual(parse_block("\n")[1].tolist(), [0]);
+        self.assertRaises(ValueError, parse_block, "1 3 1 2\n");
+        self.assertRaises(ValueError, parse_block, "1 2 1 x\n");
+        # Signs only start integers, which must fit in the integer type
+        self.assertEqual(parse_block("3 1 +1\n")[2].tolist(), [1]);
+        for text in ("3 1 1-2\n", "3 1 -\n", "3 1 --2\n", "3 1 1+\n",
+                     "3 1 2147483648\n", "3 1 99999999999999999999999\n"):
+            self.assertRaises(ValueError, parse_block, text);
+        self.assertRaises(ValueError, parse_block, "1\n");
+
+
+    def test_same_events(self):
+        with file(relative_path("scientist-4.sparse"),'r') as inp:
+            lines = inp.readlines();
+        expected = list(file2dataset(lines));
+        for chunk_size in (1, 100, 1 << 20):
+            blocks = read_blocks(StringIO("".join(lines)), chunk_size);
+            self.assertEqual([(c, fs.tolist()) for (c, fs) in events(blocks)],
+                             expected);
+        with file(relative_path("scientist-4.sparse"),'r') as inp:
+            self.assertEqual(list(file2dataset(inp)), expected);
+        (classes, indptr, indices) = load(StringIO("".join(lines)), 1000);
+        self.assertEqual(len(classes), len(expected));
+        self.assertEqual(indices[indptr[-2]:].tolist(), expected[-1][1]);
+
+
+    def test_binary(self):
+        tmp = tempfile.mkdtemp();
+        try:
+            name = os.path.join(tmp, "scientist-17.ema");
+            with file(relative_path("scientist-17.sparse"),'r') as inp:
+                meta = save_binary(name, read_blocks(inp, 1000));
+            with file(relative_path("scientist-17.sparse"),'r') as inp:
+                expected = load(inp);
+                inp.seek(0);
+                results = process_dataset(file2dataset(inp));
+            self.assertEqual(meta, {"events": len(expected.classes),
+                                    "features": expected.indices.max(),
+                                    "classes": expected.classes.max()});
+            (dataset, stored) = load_binary(name);
+            self.assertEqual(stored, meta);
+            for (a, b) in zip(dataset, expected):
+                self.assertEqual(a.tolist(), b.tolist());
+            self.assertEqual(
+                    [(c, fs.tolist()) for (c, fs) in events(split(dataset, 7))],
+                    [(c, fs.tolist()) for (c, fs) in events(expected)]);
+            self.assertEqual(process_dataset(dataset), results);
+            self.assertEqual(process_dataset(name), results);
+            with file(name, 'rb') as inp:
+                self.assertEqual(process_dataset(events(read_dataset(inp))),
+                                 results);
+        finally:
+            shutil.rmtree(tmp);
+
+
+
+    def test_index(self):
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            expected = load(inp);
+            inp.seek(0);
+            index = build_index(inp, 100);
+        self.assertEqual(index["events"], len(expected.classes));
+        self.assertEqual(index["features"], expected.indices.max());
+        self.assertEqual(index["classes"], expected.classes.max());
+        self.assertEqual(len(index["offsets"]), 6);
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            for (start, count) in ((0, 10), (250, 100), (560, None)):
+                events_read = list(events(read_dataset(inp, start, count,
+                                                       index)));
+                end = len(expected.classes) if count is None \
+                        else start + count;
+                self.assertEqual(len(events_read), end - start);
+                self.assertEqual(events_read[0][0], expected.classes[start]);
+                self.assertEqual(events_read[-1][1].tolist(),
+                        expected.indices[expected.indptr[end - 1]:
+                                         expected.indptr[end]].tolist());
+        self.assertEqual(shards(10, 3), [(0, 3), (3, 3), (6, 4)]);
+
+
+    def test_sidecar(self):
+        tmp = tempfile.mkdtemp();
+        try:
+            name = os.path.join(tmp, "scientist-17.sparse");
+            shutil.copy(relative_path("scientist-17.sparse"), name);
+            self.assertEqual(load_index(name), None);
+            index = load_index(name, create=True);
+            self.assertTrue(os.path.exists(index_name(name)));
+            self.assertEqual(load_index(name), index);
+            with file(name, 'a') as out:
+                out.write("1 1 1\n");
+            self.assertEqual(load_index(name), None);
+            self.assertEqual(load_index(name, True)["events"],
+                             index["events"] + 1);
+        finally:
+            shutil.rmtree(tmp);
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig();
+    unittest.main();
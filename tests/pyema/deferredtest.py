@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+
+"""\
+Tests the deferred learning of EMA
+"""
+
+
+import os;
+import threading;
+import time;
+import unittest;
+import logging;
+from Queue import Full;
+
+from pyema.ema import Ema, file2dataset;
+from pyema.snapshot import SnapshotEma;
+from pyema.deferred import DeferredEma;
+
+log = logging.getLogger('deferredtest');
+
+
+def relative_path(relpath):
+    """Return the absolute path correspoding to the given relative one"""
+    prefix = os.path.dirname(__file__)
+    return os.path.join(prefix,relpath)
+
+
+class _Blocked(object):
+    """Model whose learning waits until it is released"""
+
+    def __init__(self):
+        self.release = threading.Event();
+        self.learnt = [];
+
+    def learn_indices(self, f, y):
+        self.release.wait();
+        self.learnt.append((f.tolist(), y));
+        return True;
+
+
+class DeferredTest(unittest.TestCase):
+
+
+    def setUp(self):
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            self.dataset = [([f - 1 for f in fs], clss)
+                            for (clss, fs) in file2dataset(inp)][:300];
+
+
+    def test_learn(self):
+        for engine in ("csr", "rows"):
+            ema = Ema(engine=engine);
+            model = DeferredEma(SnapshotEma(Ema(engine=engine), every=None));
+            for (f, clss) in self.dataset:
+                # Bursts of the same event are coalesced
+                for _ in range(3):
+                    ema.learn_indices(f, clss);
+                    model.learn_indices(f, clss);
+            model.close();
+            self.assertEqual(model.pending, 0);
+            self.assertEqual(model.staleness, 0.);
+            model.model.publish();
+            self.assertEqual(
+                    [model.predict_rank_indices(f, 5)
+                     for (f, _) in self.dataset],
+                    [ema.predict_rank_indices(f, 5)
+                     for (f, _) in self.dataset]);
+
+
+    def test_coalesced_events(self):
+        model = DeferredEma(SnapshotEma(Ema(engine="rows"), every=5));
+        (f, clss) = self.dataset[0];
+        # The writer is held, so the burst waits in the queue
+        with model.model._lock:
+            model.learn_indices(f, clss);
+            while model._queue:
+                time.sleep(.001);
+            for _ in range(10):
+                model.learn_indices(f, clss);
+            self.assertEqual(model.pending, 11);
+        model.close();
+        self.assertEqual(model.coalesced, 9);
+        # Skipped repetitions are counted as learnt events too
+        self.assertEqual(model.model.events, 11);
+        # The snapshot due after 10 events is published after the skipped
+        # ones, since they did not change the model
+        self.assertEqual(model.model.version, 11);
+
+
+    def test_bounded(self):
+        blocked = _Blocked();
+        model = DeferredEma(blocked, maxsize=2);
+        for (f, clss) in self.dataset[:3]:
+            model.learn_indices(f, clss);
+        # One event is being learnt, two are queued
+        model.learn_indices(*self.dataset[2]);
+        self.assertRaises(Full, model.learn_indices, *self.dataset[3],
+                          block=False);
+        self.assertRaises(Full, model.learn_indices, *self.dataset[3],
+                          timeout=.01);
+        self.assertEqual(model.pending, 4);
+        self.assertEqual(model.coalesced, 1);
+        self.assertTrue(model.staleness > 0.);
+        blocked.release.set();
+        model.wait();
+        self.assertEqual(model.pending, 0);
+        self.assertEqual(blocked.learnt,
+                         [(f, clss) for (f, clss) in self.dataset[:3]] +
+                         [self.dataset[2]]);
+        model.close();
+        self.assertRaises(ValueError, model.learn_indices,
+                          *self.dataset[0]);
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig();
+    unittest.main();
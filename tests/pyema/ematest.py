@@ -25,12 +25,18 @@ Tests the python implementation of EMA
 
 
 import os;
+import multiprocessing;
+import shutil;
+import tempfile;
 import unittest;
+from StringIO import StringIO;
 import logging;
 
 import numpy;
+from scipy.sparse import csr_matrix;
 
-from pyema.ema import process_dataset, file2dataset;
+from pyema.ema import Ema, process_dataset, file2dataset, read_results, \
+        evaluate_file, _evaluate_job, copy_output;
 
 log = logging.getLogger('ematest');
 
@@ -72,6 +78,157 @@ class EmaTest(unittest.TestCase):
             self.assertTrue(numpy.allclose(result, true_result));
 
 
+    def test_indices(self):
+        ema1 = Ema();
+        ema2 = Ema();
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            for (clss, fs) in file2dataset(inp):
+                ff = [f - 1 for f in fs];
+                x = csr_matrix((numpy.ones(len(ff)), ff, [0, len(ff)]),
+                               shape=(1, max(fs)));
+                self.assertEqual(ema1.predict_rank(x),
+                                 ema2.predict_rank_indices(ff));
+                self.assertEqual(ema1.learn(x, clss),
+                                 ema2.learn_indices(ff, clss));
+        self.assertEqual(abs(ema1.W - ema2.W).max(), 0.);
+
+
+    def test_predict_and_learn(self):
+        ema1 = Ema();
+        ema2 = Ema();
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            for (clss, fs) in file2dataset(inp):
+                ff = [f - 1 for f in fs];
+                x = csr_matrix((numpy.ones(len(ff)), ff, [0, len(ff)]),
+                               shape=(1, max(fs)));
+                ranking = ema1.predict_rank(x);
+                ema1.learn(x, clss);
+                self.assertEqual(ranking, ema2.predict_and_learn(x, clss));
+        self.assertEqual(abs(ema1.W - ema2.W).max(), 0.);
+
+
+    def test_top_k(self):
+        ema = Ema(W=numpy.array([[1., 2., 2., 0., 3.],
+                                 [0., 1., 1., 2., 0.]]));
+        ranking = ema.predict_rank_indices([0, 1]);
+        self.assertEqual(ranking, [5, 3, 2, 4, 1]);
+        for k in range(7):
+            self.assertEqual(ema.predict_rank_indices([0, 1], k),
+                             ranking[:k]);
+
+
+    def test_prepare_x(self):
+        ema = Ema(W=numpy.array([[1., 2., 0.],
+                                 [0., 1., 1.]]));
+        # A dense copy of x would not fit in memory
+        x = csr_matrix(([1., 1., 1.], [1, 5, 10 ** 8], [0, 3]),
+                       shape=(1, 10 ** 9));
+        xx = ema.prepare_x(x);
+        self.assertEqual(xx.shape, (1, 2));
+        self.assertEqual(xx.toarray().tolist(), [[0., 1.]]);
+        self.assertEqual(ema.predict_rank(x), [3, 2]);
+
+
+    def test_batch(self):
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            dataset = list(file2dataset(inp));
+        for engine in ("csr", "scaled", "rows"):
+            ema = Ema(engine=engine);
+            for (clss, fs) in dataset[:400]:
+                ema.learn_indices([f - 1 for f in fs], clss);
+            queries = [[f - 1 for f in fs] for (_, fs) in dataset[400:]];
+            ranking = ema.predict_rank_batch(queries, 5);
+            self.assertEqual(ranking.shape, (len(queries), 5));
+            for (i, ff) in enumerate(queries):
+                top = ema.predict_rank_indices(ff, 5);
+                self.assertEqual(ranking[i].tolist(),
+                                 top + [0] * (5 - len(top)));
+            X = csr_matrix((numpy.ones(len(queries[0])), queries[0],
+                            [0, len(queries[0])]), shape=(1, 10000));
+            self.assertEqual(ema.predict_rank_batch(X, 5).tolist(),
+                             ranking[:1].tolist());
+
+
+    def test_streaming(self):
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            results = process_dataset(file2dataset(inp));
+        (text, stdout) = (StringIO(), StringIO());
+        binary = tempfile.TemporaryFile();
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            self.assertEqual(process_dataset(file2dataset(inp), write=text,
+                                             stdout=stdout, binary=binary,
+                                             keep=False), None);
+        self.assertEqual(text.getvalue(), "".join(
+                " {:g} {:g} {:g} {:g}\n".format(*e) for e in results));
+        mean = numpy.mean(numpy.array(results)[:, 2:], 0);
+        self.assertEqual(stdout.getvalue(), "{:g}\t{:g}\n".format(*mean));
+        binary.seek(0);
+        stored = read_results(binary);
+        self.assertEqual(len(stored), len(results));
+        self.assertEqual(numpy.array([stored["clss"], stored["yp"],
+                                      stored["r1"], stored["r5"]]).T.tolist(),
+                         results);
+
+
+
+    def test_parallel(self):
+        names = [relative_path(n) for n in ("scientist-17.sparse",
+                                            "scientist-4.sparse")];
+        options = {"limit": 300, "start": 0, "shard": None, "index": False,
+                   "engine": "csr", "report": None, "metrics": ["mrr"]};
+        (text, summary) = (StringIO(), StringIO());
+        for name in names:
+            with file(name, 'rb') as inp:
+                evaluate_file(inp, options, text, summary);
+        pool = multiprocessing.Pool(2);
+        try:
+            outputs = pool.map(_evaluate_job,
+                               [(name, options, True, False)
+                                for name in names]);
+        finally:
+            pool.close();
+            pool.join();
+        copied = StringIO();
+        for (results, _, binary) in outputs:
+            self.assertEqual(binary, None);
+            copy_output(results, copied);
+            # The results are only kept until they are copied
+            self.assertFalse(os.path.exists(results));
+        self.assertEqual(copied.getvalue(), text.getvalue());
+        self.assertEqual("".join(o[1] for o in outputs), summary.getvalue());
+
+
+
+    def test_save_and_load(self):
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            dataset = list(file2dataset(inp));
+        tmp = tempfile.mkdtemp();
+        try:
+            for engine in ("csr", "scaled", "rows"):
+                name = os.path.join(tmp, engine + ".model");
+                ema = Ema(b=.2, engine=engine);
+                for (clss, fs) in dataset[:300]:
+                    ema.learn_indices([f - 1 for f in fs], clss);
+                ema.save(name);
+                saved = ema.W.copy();
+                for mmap in (True, False):
+                    loaded = Ema.load(name, mmap);
+                    self.assertEqual(loaded._b, .2);
+                    self.assertEqual(abs(loaded.W - ema.W).max(), 0.);
+                    for (clss, fs) in dataset[300:]:
+                        ff = [f - 1 for f in fs];
+                        self.assertEqual(
+                                loaded.predict_and_learn_indices(ff, clss, 5),
+                                ema.predict_and_learn_indices(ff, clss, 5));
+                    # Learning after loading does not touch the file
+                    self.assertEqual(abs(Ema.load(name).W - saved).max(), 0.);
+                    ema = Ema.load(name, False);
+            Ema().save(name);
+            self.assertEqual(Ema.load(name).W, None);
+        finally:
+            shutil.rmtree(tmp);
+
+
 
 if __name__ == "__main__":
     #logging.basicConfig(level=logging.DEBUG);
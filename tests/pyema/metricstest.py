@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""\
+Tests the online metrics of EMA
+"""
+
+
+import os;
+import unittest;
+import logging;
+from StringIO import StringIO;
+
+import numpy;
+
+from pyema.ema import process_dataset, file2dataset;
+from pyema.metrics import RecallAtK, ReciprocalRank, Window, Ewma, \
+        parse_metric, depth;
+
+log = logging.getLogger('metricstest');
+
+
+def relative_path(relpath):
+    """Return the absolute path correspoding to the given relative one"""
+    prefix = os.path.dirname(__file__)
+    return os.path.join(prefix,relpath)
+
+
+class MetricsTest(unittest.TestCase):
+
+
+    def test_recall_and_mrr(self):
+        (r1, r2, mrr) = (RecallAtK(1), RecallAtK(2), ReciprocalRank());
+        self.assertTrue(numpy.isnan(mrr.value));
+        for (ranking, y) in (([3, 1, 2], 1), ([2], 2), ([4, 5], 1)):
+            for metric in (r1, r2, mrr):
+                metric.update(ranking, y);
+        self.assertEqual(r1.value, 1. / 3);
+        self.assertEqual(r2.value, 2. / 3);
+        self.assertEqual(mrr.value, 1.5 / 3);
+        self.assertEqual(ReciprocalRank(1).score([3, 1], 1), 0.);
+
+
+    def test_window(self):
+        w = Window(RecallAtK(1), 2);
+        for (ranking, y) in (([1], 1), ([1], 2), ([2], 2), ([1], 2)):
+            w.update(ranking, y);
+        self.assertEqual(w.value, .5);
+        w.update([2], 2);
+        self.assertEqual(w.value, .5);
+        w.update([2], 2);
+        self.assertEqual(w.value, 1.);
+
+
+    def test_ewma(self):
+        e = Ewma(RecallAtK(1), .5);
+        e.update([1], 1);
+        self.assertEqual(e.value, 1.);
+        e.update([1], 2);
+        self.assertEqual(e.value, .25 / .75);
+
+
+    def test_parse(self):
+        self.assertEqual(parse_metric("r@5").k, 5);
+        self.assertEqual(parse_metric("mrr").k, None);
+        self.assertEqual(parse_metric("MRR@10").name, "mrr@10");
+        self.assertTrue(isinstance(parse_metric("r@1/w500"), Window));
+        self.assertEqual(parse_metric("r@1/e0.01").alpha, .01);
+        self.assertEqual(parse_metric("r@1/e1").alpha, 1.);
+        for spec in ("r", "p@1", "r@1/x3", "r@1/w0", "r@1/w-5", "r@1/e0",
+                     "r@1/e-0.5", "r@1/e1.5"):
+            self.assertRaises(ValueError, parse_metric, spec);
+        self.assertEqual(depth([RecallAtK(1), RecallAtK(3)]), 3);
+        self.assertEqual(depth([RecallAtK(1), ReciprocalRank()]), None);
+
+
+    def test_process_dataset(self):
+        metrics = [parse_metric(s) for s in ("r@1", "r@10", "mrr", "r@1/w100")];
+        stdout = StringIO();
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            results = process_dataset(file2dataset(inp), stdout=stdout,
+                                      metrics=metrics);
+        results = numpy.array(results);
+        self.assertEqual(metrics[0].value, numpy.mean(results[:, 2]));
+        self.assertTrue(metrics[1].value >= numpy.mean(results[:, 3]));
+        self.assertTrue(metrics[0].value < metrics[2].value
+                        < metrics[1].value);
+        self.assertEqual(metrics[3].value, numpy.mean(results[-100:, 2]));
+        lines = stdout.getvalue().splitlines();
+        self.assertEqual(len(lines), 2);
+        self.assertEqual(lines[1].split("\t")[0],
+                         "r@1={:g}".format(metrics[0].value));
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig();
+    unittest.main();
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""\
+Tests the prediction and learning server around EMA
+"""
+
+
+import os;
+import socket;
+import threading;
+import unittest;
+import logging;
+
+from pyema.ema import Ema, file2dataset;
+from pyema.server import EmaServer;
+
+log = logging.getLogger('servertest');
+
+
+def relative_path(relpath):
+    """Return the absolute path correspoding to the given relative one"""
+    prefix = os.path.dirname(__file__)
+    return os.path.join(prefix,relpath)
+
+
+class ServerTest(unittest.TestCase):
+
+
+    def setUp(self):
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            self.dataset = list(file2dataset(inp));
+        self.server = EmaServer(Ema(engine="rows"), ("127.0.0.1", 0),
+                                budget=.05);
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(.01,));
+        self.thread.start();
+
+
+    def tearDown(self):
+        self.server.stop();
+        self.thread.join();
+        self.server.close_all();
+
+
+    def connect(self):
+        sock = socket.create_connection(self.server.address);
+        return (sock, sock.makefile('r'));
+
+
+    def test_protocol(self):
+        (sock, inp) = self.connect();
+        ema = Ema(engine="rows");
+        for (clss, fs) in self.dataset[:100]:
+            sock.sendall("STEP 5 {:d} {:s}\n".format(
+                    clss, " ".join(map(str, fs))));
+            expected = ema.predict_and_learn_indices([f - 1 for f in fs],
+                                                     clss, 5);
+            self.assertEqual(inp.readline().split(),
+                             ["OK"] + map(str, expected));
+        (clss, fs) = self.dataset[100];
+        sock.sendall("LEARN {:d} {:s}\n".format(clss, " ".join(map(str, fs))));
+        self.assertEqual(inp.readline(), "OK\n");
+        ema.learn_indices([f - 1 for f in fs], clss);
+        sock.sendall("PREDICT 3 {:s}\n".format(" ".join(map(str, fs))));
+        expected = ema.predict_rank_indices([f - 1 for f in fs], 3);
+        self.assertEqual(inp.readline().split(), ["OK"] + map(str, expected));
+        for request in ("PREDICT x 1", "LEARN 0 1", "PREDICT 3 0", "FOO"):
+            sock.sendall(request + "\n");
+            self.assertTrue(inp.readline().startswith("ERR"));
+        sock.sendall("QUIT\n");
+        self.assertEqual(inp.readline(), "");
+        sock.close();
+
+
+    def test_pipelined(self):
+        (sock, inp) = self.connect();
+        sock.sendall("LEARN 2 1 2\nLEARN 3 1 2\n");
+        self.assertEqual([inp.readline(), inp.readline()], ["OK\n"] * 2);
+        # Replies keep the order of requests, even when answered at once
+        sock.sendall("PREDICT 3 1 2\nFOO\nPREDICT 3 1 2\nPREDICT x\n");
+        self.assertEqual(inp.readline(), "OK 3 2\n");
+        self.assertTrue(inp.readline().startswith("ERR unknown command"));
+        self.assertEqual(inp.readline(), "OK 3 2\n");
+        self.assertTrue(inp.readline().startswith("ERR wrong request"));
+        sock.sendall("PREDICT 3 1 2\nQUIT\n");
+        self.assertEqual(inp.readline(), "OK 3 2\n");
+        self.assertEqual(inp.readline(), "");
+        sock.close();
+
+
+    def test_batching(self):
+        ema = Ema(engine="rows");
+        (sock, inp) = self.connect();
+        for (clss, fs) in self.dataset[:200]:
+            ema.learn_indices([f - 1 for f in fs], clss);
+            sock.sendall("LEARN {:d} {:s}\n".format(
+                    clss, " ".join(map(str, fs))));
+            inp.readline();
+        clients = [self.connect() for _ in range(4)];
+        queries = [fs for (_, fs) in self.dataset[200:240]];
+        for (i, fs) in enumerate(queries):
+            clients[i % 4][0].sendall("PREDICT 5 {:s}\n".format(
+                    " ".join(map(str, fs))));
+        for (i, fs) in enumerate(queries):
+            expected = ema.predict_rank_indices([f - 1 for f in fs], 5);
+            self.assertEqual(clients[i % 4][1].readline().split(),
+                             ["OK"] + map(str, expected));
+        self.assertEqual(self.server.predictions, len(queries));
+        self.assertTrue(self.server.batches < len(queries));
+        for (client, _) in clients + [(sock, inp)]:
+            client.close();
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig();
+    unittest.main();
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+
+"""\
+Tests the model shared by several processes
+"""
+
+
+import os;
+import shutil;
+import tempfile;
+import multiprocessing;
+import unittest;
+import logging;
+
+from pyema.ema import Ema, file2dataset;
+from pyema.shared import SharedWriter, SharedReader, CURRENT, \
+        current_generation, generation_name;
+
+log = logging.getLogger('sharedtest');
+
+
+def relative_path(relpath):
+    """Return the absolute path correspoding to the given relative one"""
+    prefix = os.path.dirname(__file__)
+    return os.path.join(prefix,relpath)
+
+
+def _predict(job):
+    """It predicts from the last generation in a worker process"""
+    (directory, queries) = job;
+    model = SharedReader(directory, interval=0);
+    return (model.version,
+            [model.predict_rank_indices(f, 5) for f in queries]);
+
+
+class SharedTest(unittest.TestCase):
+
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp();
+        self.directory = os.path.join(self.tmp, "model");
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            self.dataset = [([f - 1 for f in fs], clss)
+                            for (clss, fs) in file2dataset(inp)][:300];
+        self.queries = [f for (f, _) in self.dataset[::30]];
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp);
+
+
+    def test_generations(self):
+        writer = SharedWriter(self.directory, keep=2);
+        reader = SharedReader(self.directory, interval=0);
+        self.assertEqual(reader.version, 0);
+        self.assertEqual(reader.predict_rank_indices(self.queries[0], 5), []);
+        ema = Ema(engine="csr");
+        for (i, (f, clss)) in enumerate(self.dataset):
+            ema.learn_indices(f, clss);
+            if (i + 1) % 100 == 0:
+                self.assertEqual(writer.publish(ema), (i + 1) // 100);
+                expected = [ema.predict_rank_indices(q, 5)
+                            for q in self.queries];
+                self.assertEqual([reader.predict_rank_indices(q, 5)
+                                  for q in self.queries], expected);
+                self.assertEqual(reader.version, writer.generation);
+        # W is mapped, not copied
+        self.assertFalse(reader.snapshot().ema._W._data.flags.owndata);
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [CURRENT, generation_name(2), generation_name(3)]);
+        self.assertEqual(current_generation(self.directory)[0], 3);
+        # A new writer goes on from the last generation
+        self.assertEqual(SharedWriter(self.directory).publish(ema), 4);
+
+
+    def test_interval(self):
+        writer = SharedWriter(self.directory);
+        ema = Ema(engine="rows");
+        writer.publish(ema);
+        reader = SharedReader(self.directory, interval=3600);
+        self.assertEqual(reader.snapshot().version, 1);
+        writer.publish(ema);
+        self.assertEqual(reader.snapshot().version, 1);
+        self.assertTrue(reader.refresh());
+        self.assertEqual(reader.version, 2);
+        self.assertFalse(reader.refresh());
+
+
+    def test_processes(self):
+        writer = SharedWriter(self.directory);
+        ema = Ema(engine="scaled");
+        for (f, clss) in self.dataset:
+            ema.learn_indices(f, clss);
+        writer.publish(ema);
+        expected = [ema.predict_rank_indices(q, 5) for q in self.queries];
+        pool = multiprocessing.Pool(2);
+        try:
+            results = pool.map(_predict, [(self.directory, self.queries)] * 4);
+        finally:
+            pool.terminate();
+            pool.join();
+        self.assertEqual(results, [(1, expected)] * 4);
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig();
+    unittest.main();
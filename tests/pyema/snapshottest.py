@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+
+"""\
+Tests the snapshot-isolated predictions of EMA
+"""
+
+
+import os;
+import threading;
+import unittest;
+import logging;
+
+from pyema.ema import Ema, file2dataset;
+from pyema.snapshot import SnapshotEma, freeze;
+
+log = logging.getLogger('snapshottest');
+
+
+def relative_path(relpath):
+    """Return the absolute path correspoding to the given relative one"""
+    prefix = os.path.dirname(__file__)
+    return os.path.join(prefix,relpath)
+
+
+class SnapshotTest(unittest.TestCase):
+
+
+    def setUp(self):
+        with file(relative_path("scientist-17.sparse"),'r') as inp:
+            self.dataset = [([f - 1 for f in fs], clss)
+                            for (clss, fs) in file2dataset(inp)][:400];
+
+
+    def test_freeze(self):
+        for engine in ("csr", "scaled", "rows"):
+            ema = Ema(engine=engine);
+            for (f, clss) in self.dataset[:200]:
+                ema.learn_indices(f, clss);
+            frozen = freeze(ema);
+            expected = [ema.predict_rank_indices(f, 5)
+                        for (f, _) in self.dataset[200:]];
+            for (f, clss) in self.dataset[200:]:
+                ema.learn_indices(f, clss);
+            self.assertEqual([frozen.predict_rank_indices(f, 5)
+                              for (f, _) in self.dataset[200:]], expected);
+
+
+    def test_every(self):
+        model = SnapshotEma(Ema(engine="rows"), every=50);
+        ema = Ema(engine="rows");
+        (f0, _) = self.dataset[0];
+        self.assertEqual(model.predict_rank_indices(f0, 5), []);
+        for (i, (f, clss)) in enumerate(self.dataset[:120]):
+            self.assertEqual(model.predict_and_learn_indices(f, clss, 5),
+                             ema.predict_and_learn_indices(f, clss, 5));
+            self.assertEqual(model.version, (i + 1) // 50 * 50);
+            if i + 1 == 100:
+                expected = ema.predict_rank_indices(f0, 5);
+        self.assertEqual(model.events, 120);
+        self.assertEqual(model.predict_rank_indices(f0, 5), expected);
+        model.publish();
+        self.assertEqual(model.version, 120);
+        self.assertEqual(model.predict_rank_indices(f0, 5),
+                         ema.predict_rank_indices(f0, 5));
+
+
+    def test_concurrent_readers(self):
+        model = SnapshotEma(Ema(engine="csr"), every=25);
+        queries = [f for (f, _) in self.dataset[::40]];
+        seen = [];
+        done = threading.Event();
+
+        def read():
+            while not done.is_set():
+                snapshot = model.snapshot();
+                seen.append((snapshot.version,
+                             [snapshot.ema.predict_rank_indices(f, 5)
+                              for f in queries]));
+
+        readers = [threading.Thread(target=read) for _ in range(3)];
+        for reader in readers:
+            reader.start();
+        for (f, clss) in self.dataset:
+            model.learn_indices(f, clss);
+        done.set();
+        for reader in readers:
+            reader.join();
+
+        # Every prediction is the one of the model at its version
+        expected = {};
+        ema = Ema(engine="csr");
+        for (i, (f, clss)) in enumerate(self.dataset):
+            if i % 25 == 0:
+                expected[i] = [ema.predict_rank_indices(q, 5)
+                               for q in queries];
+            ema.learn_indices(f, clss);
+        expected[len(self.dataset)] = [ema.predict_rank_indices(q, 5)
+                                       for q in queries];
+        self.assertTrue(seen);
+        for (version, rankings) in seen:
+            self.assertEqual(rankings, expected[version]);
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig();
+    unittest.main();
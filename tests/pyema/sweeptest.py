@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""\
+Tests the search of the parameters of EMA
+"""
+
+
+import os;
+import unittest;
+import logging;
+
+import numpy;
+
+from pyema.ema import process_dataset;
+from pyema.sweep import grid, sample, load_datasets, sweep;
+
+log = logging.getLogger('sweeptest');
+
+
+def relative_path(relpath):
+    """Return the absolute path correspoding to the given relative one"""
+    prefix = os.path.dirname(__file__)
+    return os.path.join(prefix,relpath)
+
+
+class SweepTest(unittest.TestCase):
+
+
+    def test_configs(self):
+        configs = grid([.1, .2], [.15], [.01, .02, .03]);
+        self.assertEqual(len(configs), 6);
+        self.assertEqual(configs[1], {"b": .1, "d": .15, "w": .02});
+        configs = sample(20, [.1, .2], [.15], [.01, .02], seed=3);
+        self.assertEqual(configs, sample(20, [.1, .2], [.15], [.01, .02], 3));
+        self.assertTrue(all(.1 <= c["b"] <= .2 and c["d"] == .15
+                            for c in configs));
+
+
+    def test_sweep(self):
+        with file(relative_path("scientist-17.sparse"),'rb') as inp:
+            datasets = load_datasets([inp], 300);
+        self.assertEqual(len(datasets[0].classes), 300);
+        configs = grid([.15, .3], [.15], [.01]);
+        serial = list(sweep(datasets, configs, processes=1));
+        parallel = list(sweep(datasets, configs, processes=2));
+        self.assertEqual([r[:2] for r in serial], [r[:2] for r in parallel]);
+        self.assertEqual([r[0] for r in serial], configs);
+        results = numpy.array(process_dataset(datasets[0]));
+        self.assertEqual(serial[0][1], numpy.mean(results[:, 2:], 0).tolist());
+        self.assertNotEqual(serial[0][1], serial[1][1]);
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig();
+    unittest.main();
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# coding=utf-8
+##
+# This file is part of pyema.
+#
+# pyema is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyema is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyema.  If not, see <http://www.gnu.org/licenses/>.
+##
+
+
+
+"""\
+Tests the storage of the matrix of weights of EMA
+"""
+
+
+import os;
+import unittest;
+import logging;
+
+import numpy;
+from scipy.sparse import coo_matrix, csr_matrix;
+
+from pyema.ema import Ema, file2dataset, process_dataset;
+from pyema.weights import CsrWeights, ScaledCsrWeights, RowWeights;
+
+log = logging.getLogger('weightstest');
+
+
+def relative_path(relpath):
+    """Return the absolute path correspoding to the given relative one"""
+    prefix = os.path.dirname(__file__)
+    return os.path.join(prefix,relpath)
+
+
+def learn_file(ema, name, limit=None):
+    """Make ema learn the first limit entries of the given dataset"""
+    with file(relative_path(name),'r') as inp:
+        for (i, (clss, fs)) in enumerate(file2dataset(inp)):
+            if limit and i >= limit:
+                break;
+            x = coo_matrix((numpy.ones(len(fs)),
+                            (numpy.zeros(len(fs)), [f - 1 for f in fs])),
+                           shape=(1, max(fs)));
+            ema.learn(x.tocsr(), clss);
+    return ema;
+
+
+class CsrWeightsTest(unittest.TestCase):
+
+
+    def test_rowsums(self):
+        ema = learn_file(Ema(), "scientist-17.sparse");
+        W = ema.W;
+        true_sums = numpy.asarray(W.sum(1)).ravel();
+        self.assertTrue(numpy.allclose(ema._W.rowsums, true_sums));
+
+
+    def test_lookup_and_total(self):
+        W = CsrWeights(W=numpy.array([[1., 0., 2.],
+                                      [0., 3., 4.]]));
+        f = numpy.array([0, 1]);
+        v = numpy.array([1., 2.]);
+        self.assertEqual(W.lookup(f, v, 2), 10.);
+        self.assertEqual(W.lookup(f, v, 1), 6.);
+        self.assertEqual(W.total(f, v), 17.);
+
+
+    def test_prune_touched_rows(self):
+        W = CsrWeights(W=numpy.array([[.001, 1., .002],
+                                      [.003, 0., 4.]]));
+        self.assertTrue(W.prune(numpy.array([0]), .01));
+        self.assertEqual(W.matrix[1, 0], .003);
+        self.assertEqual(numpy.count_nonzero(W.matrix.data), 3);
+        self.assertTrue(numpy.allclose(W.rowsums, [1., 4.003]));
+        W.compact();
+        self.assertEqual(W.matrix.toarray().tolist(),
+                         [[0., 1., 0.], [.003, 0., 4.]]);
+        self.assertFalse(W.prune(numpy.array([0]), .01));
+
+
+    def test_boost_in_place(self):
+        W = CsrWeights(W=numpy.array([[1., 0., 2.],
+                                      [0., 3., 4.]]));
+        data = W._data;
+        matrix = W.matrix;
+        W.boost(numpy.array([0, 1]), numpy.array([1., 1.]), 1);
+        self.assertTrue(W._data is data);
+        self.assertEqual(W.matrix.toarray().tolist(),
+                         [[1., 1., 2.], [0., 4., 4.]]);
+        # The matrix read before is a copy
+        self.assertEqual(matrix.toarray().tolist(),
+                         [[1., 0., 2.], [0., 3., 4.]]);
+        # Filling up the row moves it
+        W.resize(2, 8);
+        for c in range(3, 8):
+            W.boost(numpy.array([0]), numpy.array([1.]), c);
+        self.assertEqual(W.matrix.toarray()[0].tolist(),
+                         [1., 1., 2., 1., 1., 1., 1., 1.]);
+        self.assertEqual(W.rowsums.tolist(), [9., 8.]);
+
+
+    def test_move_full_row(self):
+        W = CsrWeights(W=numpy.array([[1., 0., 2.],
+                                      [0., 3., 4.]]));
+        W.resize(2, 8);
+        self.assertEqual(W._starts.tolist(), [0, 4]);
+        for c in range(3, 6):
+            W.boost(numpy.array([0]), numpy.array([1.]), c);
+        # Only the full row is moved, to the end of the storage
+        self.assertEqual(W._starts.tolist(), [8, 4]);
+        data = W._data;
+        for c in range(5, 8):
+            W.boost(numpy.array([1]), numpy.array([1.]), c);
+        self.assertEqual(W._starts.tolist(), [8, 16]);
+        self.assertTrue(W._data is data);
+        expected = [[1., 0., 2., 1., 1., 1., 0., 0.],
+                    [0., 3., 4., 0., 0., 1., 1., 1.]];
+        self.assertEqual(W.matrix.toarray().tolist(), expected);
+        (classes, scores) = W.scores(numpy.array([0, 1]),
+                                     numpy.array([1., 1.]));
+        self.assertEqual(classes.tolist(), range(8));
+        X = csr_matrix(numpy.array([[1., 0.], [1., 2.]]));
+        self.assertEqual(W.scores_batch(X).toarray().tolist(),
+                         (X * csr_matrix(expected)).toarray().tolist());
+        # Compacting W lays it out again, without the old slots
+        W.compact();
+        self.assertEqual(W._starts.tolist(), [0, 10]);
+        self.assertEqual(W.matrix.nnz, 10);
+        self.assertEqual(W.matrix.toarray().tolist(), expected);
+
+
+
+    def test_capacity(self):
+        W = CsrWeights((2, 2));
+        W.resize(3, 3);
+        self.assertEqual(W.shape, (3, 3));
+        self.assertEqual(W.capacity, (4, 4));
+        self.assertEqual(W.matrix.shape, (3, 3));
+        W.resize(4, 4);
+        self.assertEqual(W.capacity, (4, 4));
+        W.reserve(10, 20);
+        self.assertEqual(W.shape, (4, 4));
+        self.assertEqual(W.capacity, (10, 20));
+        self.assertEqual(len(W.rowsums), 4);
+
+
+    def test_lazy_resize(self):
+        W = CsrWeights((2, 2));
+        W.reserve(10, 10);
+        data = W._data;
+        W.resize(3, 3);
+        W.boost(numpy.array([2]), numpy.array([1.]), 2);
+        # Resizing within the capacity does not touch the storage
+        self.assertTrue(W._data is data);
+        (classes, scores) = W.scores(numpy.array([2]), numpy.array([2.]));
+        self.assertEqual((classes.tolist(), scores.tolist()), ([2], [2.]));
+        self.assertEqual(W.matrix.toarray().tolist(),
+                         [[0., 0., 0.], [0., 0., 0.], [0., 0., 1.]]);
+
+
+    def test_reserve(self):
+        ema = Ema();
+        ema.reserve(1000, 100);
+        learn_file(ema, "scientist-17.sparse", 20);
+        self.assertEqual(ema._W.capacity, (1000, 100));
+        self.assertTrue(ema.W.shape < (1000, 100));
+        # The storage reserved learns the same weights
+        self.assertEqual(abs(ema.W - learn_file(Ema(), "scientist-17.sparse",
+                                                20).W).max(), 0.);
+
+
+
+    def test_packed_state(self):
+        for engine in (CsrWeights, ScaledCsrWeights):
+            W = engine(W=numpy.array([[1., 0., 2.],
+                                      [0., 3., 4.]]));
+            W.reserve(10, 10);
+            W.resize(3, 4);
+            W.boost(numpy.array([2]), numpy.array([1.]), 3);
+            W.prune(numpy.array([0]), 1.5);
+            (meta, arrays) = W.get_state();
+            arrays = dict(arrays);
+            # Only the weights are saved, without any slack
+            self.assertEqual(arrays["data"].tolist(), [2., 3., 4., 1.]);
+            self.assertEqual(arrays["indptr"].tolist(), [0, 1, 3, 4]);
+            self.assertEqual(meta["capacity"], [3, 4]);
+            self.assertEqual(len(arrays["rowsums"]), 3);
+            loaded = engine.from_state(meta, arrays);
+            self.assertEqual(loaded.matrix.toarray().tolist(),
+                             W.matrix.toarray().tolist());
+            loaded.boost(numpy.array([0, 1]), numpy.array([1., 1.]), 0);
+            self.assertEqual(loaded.matrix.toarray().tolist(),
+                             [[1., 0., 2., 0.], [1., 3., 4., 0.],
+                              [0., 0., 0., 1.]]);
+            self.assertEqual(loaded.rowsums.tolist(), [3., 8., 1.]);
+
+
+
+class ScaledCsrWeightsTest(unittest.TestCase):
+
+
+    def test_same_weights(self):
+        W = learn_file(Ema(), "scientist-17.sparse").W;
+        ema = learn_file(Ema(engine="scaled"), "scientist-17.sparse");
+        self.assertTrue(numpy.allclose(ema._W.rowsums,
+                                       numpy.asarray(W.sum(1)).ravel()));
+        self.assertTrue(abs(ema.W - W).max() < 1e-9);
+
+
+    def test_lazy_decay(self):
+        W = ScaledCsrWeights(W=numpy.array([[.5, 1., 2.],
+                                            [0., 3., 4.]]));
+        W.decay(numpy.array([0]), numpy.array([.5]));
+        # Weights are not touched by the decay
+        data = W._data;
+        self.assertEqual(data[data != 0].tolist(), [.5, 1., 2., 3., 4.]);
+        self.assertEqual(W.lookup(numpy.array([0]), numpy.array([1.]), 1),
+                         .5);
+        self.assertTrue(W.prune(numpy.array([0]), .3));
+        self.assertEqual(W.matrix.toarray()[0].tolist(), [0., .5, 1.]);
+        self.assertEqual(W.rowsums.tolist(), [1.5, 7.]);
+
+
+
+class RowWeightsTest(unittest.TestCase):
+
+
+    def test_same_weights(self):
+        W = learn_file(Ema(), "scientist-17.sparse").W;
+        ema = learn_file(Ema(engine="rows"), "scientist-17.sparse");
+        self.assertEqual(abs(ema.W - W).max(), 0.);
+        self.assertTrue(numpy.allclose(ema._W.rowsums,
+                                       numpy.asarray(W.sum(1)).ravel()));
+
+
+    def test_same_results(self):
+        results = [];
+        for engine in ("csr", "rows"):
+            with file(relative_path("scientist-17.sparse"),'r') as inp:
+                results.append(process_dataset(file2dataset(inp),
+                                               engine=engine));
+        self.assertEqual(results[0], results[1]);
+
+
+    def test_scores(self):
+        W = RowWeights(W=numpy.array([[1., 0., 2.],
+                                      [0., 3., 4.]]));
+        (classes, scores) = W.scores(numpy.array([1, 0]),
+                                     numpy.array([1., 2.]));
+        self.assertEqual(dict(zip(classes, scores)), {0: 2., 1: 3., 2: 8.});
+        W.decay(numpy.array([1]), numpy.array([.5]));
+        W.boost(numpy.array([0, 1]), numpy.array([1., 1.]), 1);
+        self.assertTrue(W.prune(numpy.array([0, 1]), 1.1));
+        self.assertEqual(W.matrix.toarray().tolist(),
+                         [[0., 0., 2.], [0., 2.5, 2.]]);
+        self.assertEqual(W.rowsums.tolist(), [2., 4.5]);
+
+
+    def test_snapshot(self):
+        W = RowWeights(W=numpy.array([[1., 0., 2.],
+                                      [0., 3., 4.]]));
+        copy = W.snapshot();
+        # Rows are shared until they are updated
+        self.assertTrue(copy._rows[0] is W._rows[0]);
+        W.decay(numpy.array([1]), numpy.array([.5]));
+        W.boost(numpy.array([1]), numpy.array([1.]), 0);
+        self.assertTrue(copy._rows[0] is W._rows[0]);
+        self.assertFalse(copy._rows[1] is W._rows[1]);
+        self.assertEqual(W.matrix.toarray().tolist(),
+                         [[1., 0., 2.], [1., 1.5, 2.]]);
+        self.assertEqual(copy.matrix.toarray().tolist(),
+                         [[1., 0., 2.], [0., 3., 4.]]);
+        self.assertEqual(copy.rowsums.tolist(), [3., 7.]);
+        # A new row belongs to W alone, so it is not copied again
+        W.resize(3, 3);
+        W.boost(numpy.array([2]), numpy.array([1.]), 1);
+        row = W._rows[2];
+        W.boost(numpy.array([2]), numpy.array([1.]), 2);
+        self.assertTrue(W._rows[2] is row);
+        self.assertFalse(2 in copy._rows);
+        W.snapshot();
+        self.assertTrue(W.prune(numpy.array([0]), 1.5));
+        self.assertEqual(copy.matrix.toarray()[0].tolist(), [1., 0., 2.]);
+
+
+
+if __name__ == "__main__":
+    logging.basicConfig();
+    unittest.main();